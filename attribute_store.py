@@ -0,0 +1,107 @@
+import hashlib
+import h5py
+import numpy as np
+import pandas as pd
+
+
+def checkpoint_hash(model_weights, length=12):
+    """Short sha256 of a checkpoint file, so scores of different weights never mix."""
+    digest = hashlib.sha256()
+    with open(model_weights, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:length]
+
+
+class AttributeStore(object):
+    """
+    Every patch's attribute score, per class branch, aligned with its coords.
+
+    One HDF5 file laid out as ``/<checkpoint hash>/<slide_id>/{scores, coords}`` with ``scores`` C x N float32 and
+    ``coords`` N x 2, chunked and lzf-compressed so a slide can be read on its own. The class names are stored
+    on the checkpoint group. Queries return DataFrames with the ``patch`` index, ``score`` and ``coord_x``/``coord_y``.
+    """
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.file = h5py.File(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def checkpoints(self):
+        return list(self.file.keys())
+
+    def slides(self, ckpt=None):
+        return list(self._group(ckpt).keys())
+
+    def class_names(self, ckpt=None):
+        return [str(name) for name in self._group(ckpt).attrs['class_names']]
+
+    def _group(self, ckpt=None):
+        if ckpt is None:
+            if len(self.file) != 1:
+                raise KeyError("{} holds {} checkpoints, pass ckpt= one of {}".format(self.path, len(self.file), self.checkpoints()))
+            ckpt = self.checkpoints()[0]
+        return self.file[ckpt]
+
+    def put(self, slide_id, scores, coords, ckpt, class_names):
+        group = self.file.require_group(ckpt)
+        group.attrs['class_names'] = list(class_names)
+        if slide_id in group:
+            del group[slide_id]
+        slide = group.create_group(slide_id)
+        n = scores.shape[1]
+        slide.create_dataset('scores', data=np.asarray(scores, dtype=np.float32),
+                             chunks=(1, min(n, 1 << 14)) if n else None, compression='lzf')
+        slide.create_dataset('coords', data=np.asarray(coords), chunks=(min(n, 1 << 14), 2) if n else None,
+                             compression='lzf')
+
+    def get(self, slide_id, ckpt=None):
+        """(scores [C x N], coords [N x 2]) of a slide."""
+        slide = self._group(ckpt)[slide_id]
+        return slide['scores'][()], slide['coords'][()]
+
+    def _class_scores(self, slide_id, class_name, ckpt):
+        group = self._group(ckpt)
+        class_idx = self.class_names(ckpt).index(class_name)
+        return group[slide_id]['scores'][class_idx], group[slide_id]['coords'][()]
+
+    @staticmethod
+    def _frame(patches, scores, coords):
+        coords = coords[patches]
+        return pd.DataFrame({'patch': patches, 'score': scores, 'coord_x': coords[:, 0], 'coord_y': coords[:, 1]})
+
+    def top_k(self, slide_id, class_name, k=3, largest=True, ckpt=None):
+        """The k highest (or lowest) scoring patches of a class branch, ranked."""
+        scores, coords = self._class_scores(slide_id, class_name, ckpt)
+        k = min(k, len(scores))
+        order = -scores if largest else scores
+        patches = np.argpartition(order, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+        patches = patches[np.argsort(order[patches], kind='stable')]
+        df = self._frame(patches, scores[patches], coords)
+        df.insert(0, 'rank', np.arange(1, k + 1))
+        return df
+
+    def above(self, slide_id, class_name, threshold, ckpt=None):
+        """All patches of a class branch scoring above ``threshold``, highest first."""
+        scores, coords = self._class_scores(slide_id, class_name, ckpt)
+        patches = np.flatnonzero(scores > threshold)
+        patches = patches[np.argsort(-scores[patches], kind='stable')]
+        return self._frame(patches, scores[patches], coords)
+
+    def in_bbox(self, slide_id, x0, y0, x1, y1, ckpt=None):
+        """Patches whose coords fall in [x0, x1) x [y0, y1), with the score of every class branch."""
+        group = self._group(ckpt)
+        coords = group[slide_id]['coords'][()]
+        patches = np.flatnonzero((coords[:, 0] >= x0) & (coords[:, 0] < x1) & (coords[:, 1] >= y0) & (coords[:, 1] < y1))
+        scores = group[slide_id]['scores'][()][:, patches]
+        df = pd.DataFrame({'patch': patches, 'coord_x': coords[patches, 0], 'coord_y': coords[patches, 1]})
+        for class_name, class_scores in zip(self.class_names(ckpt), scores):
+            df[class_name] = class_scores
+        return df
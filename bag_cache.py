@@ -0,0 +1,152 @@
+import os
+import atexit
+from collections import OrderedDict
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+try:
+    from multiprocessing import resource_tracker
+except ImportError:  # windows has no resource tracker
+    resource_tracker = None
+
+
+class SharedBagCache(object):
+    """Byte-bounded LRU cache of decoded bags, shared by all DataLoader workers.
+
+    Every cached bag lives in its own ``multiprocessing.shared_memory`` segment,
+    so a worker that hits the cache maps the arrays another worker decoded
+    instead of reading the h5 file again. The index, recency ticks and hit/miss
+    counters are kept in a ``multiprocessing.Manager`` that is started by the
+    process creating the cache; only its proxies travel to the workers.
+
+    ``get`` returns copies of the cached arrays, so a worker can unmap segments
+    it no longer needs without invalidating bags it has already handed out.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = int(max_bytes)
+        self._manager = mp.Manager()
+        self._entries = self._manager.dict()  # key -> (segment name, nbytes, [(shape, dtype, offset)])
+        self._recency = self._manager.dict()  # key -> tick of the last access
+        self._stats = self._manager.dict(hits=0, misses=0, evictions=0, bytes=0, tick=0)
+        self._lock = self._manager.Lock()
+        self._attached = OrderedDict()  # segment name -> (SharedMemory, nbytes), least recently used first
+        self._attached_bytes = 0
+        self._owner = os.getpid()
+        if resource_tracker is not None:
+            # workers must inherit this tracker; one of their own would unlink the segments they created when they exit
+            resource_tracker.ensure_running()
+        atexit.register(self.close)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_manager'] = None
+        state['_attached'] = OrderedDict()
+        state['_attached_bytes'] = 0
+        return state
+
+    def _touch(self, key):
+        tick = self._stats['tick'] + 1
+        self._stats['tick'] = tick
+        self._recency[key] = tick
+
+    def _attach(self, name, nbytes):
+        # local LRU of mapped segments: the live ones never exceed max_bytes, so anything mapped past that
+        # budget is evicted or cold and is unmapped without asking the manager which entries are still live;
+        # get only hands out copies, so unmapping never leaves a returned array dangling
+        if name in self._attached:
+            self._attached.move_to_end(name)
+            return self._attached[name][0]
+        shm = shared_memory.SharedMemory(name=name)
+        self._attached[name] = (shm, nbytes)
+        self._attached_bytes += nbytes
+        while self._attached_bytes > self.max_bytes and len(self._attached) > 1:
+            old, old_bytes = self._attached.popitem(last=False)[1]
+            self._attached_bytes -= old_bytes
+            old.close()
+        return shm
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            self._touch(key)
+            # attach while holding the lock so the segment cannot be evicted in between
+            shm = self._attach(entry[0], entry[1])
+        # an unlink by another worker leaves this process's mapping intact, so the copy runs outside the lock
+        return tuple(np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+                     for shape, dtype, offset in entry[2])
+
+    def put(self, key, arrays):
+        arrays = [np.ascontiguousarray(a) for a in arrays]
+        layout, size = [], 0
+        for a in arrays:
+            size = (size + 63) // 64 * 64
+            layout.append((a.shape, a.dtype.str, size))
+            size += a.nbytes
+        nbytes = sum(a.nbytes for a in arrays)
+        if nbytes > self.max_bytes:
+            return False
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for a, (shape, dtype, offset) in zip(arrays, layout):
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = a
+        with self._lock:
+            if key in self._entries:  # another worker cached it first
+                shm.close()
+                shm.unlink()
+                return True
+            used = self._stats['bytes']
+            if used + nbytes > self.max_bytes:
+                for old_key, _ in sorted(self._recency.items(), key=lambda item: item[1]):
+                    used -= self._evict(old_key)
+                    if used + nbytes <= self.max_bytes:
+                        break
+            self._entries[key] = (shm.name, nbytes, layout)
+            self._touch(key)
+            self._stats['bytes'] = used + nbytes
+        shm.close()
+        return True
+
+    def _evict(self, key):
+        name, nbytes, _ = self._entries.pop(key)
+        self._recency.pop(key, None)
+        self._stats['evictions'] += 1
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        return nbytes
+
+    def info(self):
+        stats = dict(self._stats)
+        stats.pop('tick')
+        stats.update({'entries': len(self._entries), 'max_bytes': self.max_bytes})
+        return stats
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries.keys()):
+                self._evict(key)
+            self._stats['bytes'] = 0
+
+    def close(self):
+        if os.getpid() != self._owner or self._manager is None:
+            return
+        for shm, _ in self._attached.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass
+        self._attached = OrderedDict()
+        self._attached_bytes = 0
+        try:
+            self.clear()
+        except (OSError, EOFError):  # manager already gone at interpreter exit
+            pass
+        self._manager.shutdown()
+        self._manager = None
@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import h5py
+import numpy as np
+import pandas as pd
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataloader import Generic_MIL_Dataset, Generic_Split
+from feature_store import build_feature_store
+from utils import collate_MIL_coords, get_split_loader
+
+# storage format -> h5 compression of the synthetic cohort ('store' packs the uncompressed cohort into a FeatureStore)
+FORMATS = {'h5': None, 'h5_lzf': 'lzf', 'h5_gzip': 'gzip', 'store': None}
+
+
+def make_cohort(root, n_slides=64, min_patches=1000, max_patches=20000, dim=1536, k=9, compression=None, seed=0):
+    """
+    Synthetic cohort in the layout Generic_MIL_Dataset reads: ``<root>/h5_coords_files/<slide_id>.h5`` with
+    features (N x dim float32), coords (N x 2) and nearest (N x k), plus ``<root>/cohort.csv``.
+    """
+    rng = np.random.RandomState(seed)
+    h5_dir = os.path.join(root, 'h5_coords_files')
+    os.makedirs(h5_dir, exist_ok=True)
+    rows = []
+    for i in range(n_slides):
+        slide_id = 'SYN-{:04d}'.format(i)
+        n = int(rng.randint(min_patches, max_patches + 1))
+        side = int(np.ceil(np.sqrt(n)))
+        grid = np.stack(np.divmod(np.arange(n), side), axis=1)[:, ::-1] * 512
+        with h5py.File(os.path.join(h5_dir, slide_id + '.h5'), 'w') as f:
+            f.create_dataset('features', data=rng.standard_normal((n, dim)).astype(np.float32), compression=compression)
+            f.create_dataset('coords', data=grid.astype(np.int64), compression=compression)
+            f.create_dataset('nearest', data=rng.randint(0, n, size=(n, k)).astype(np.int64), compression=compression)
+        rows.append({'case_id': 'case_{}'.format(i), 'slide_id': slide_id, 'label': i % 2})
+    csv_path = os.path.join(root, 'cohort.csv')
+    pd.DataFrame(rows).to_csv(csv_path, index=False)
+    return csv_path
+
+
+def bag_bytes(item):
+    features, _, coords, nearest = item
+    return features.numel() * features.element_size() + coords.nbytes + nearest.nbytes
+
+
+def bench_getitem(dataset):
+    start = time.perf_counter()
+    n_bytes = sum(bag_bytes(dataset[idx]) for idx in range(len(dataset)))
+    return len(dataset), n_bytes, time.perf_counter() - start
+
+
+def bench_collate(dataset):
+    items = [dataset[idx] for idx in range(len(dataset))]
+    start = time.perf_counter()
+    for item in items:
+        collate_MIL_coords([item])
+    return len(items), sum(bag_bytes(item) for item in items), time.perf_counter() - start
+
+
+def bench_loader(split, num_workers, batch_size=1):
+    loader = get_split_loader(split, training=True, batch_size=batch_size, num_workers=num_workers)
+    start = time.perf_counter()
+    n_bags = n_bytes = 0
+    for batch in loader:
+        features = batch[0]
+        n_bags += len(batch[1])
+        n_bytes += features.numel() * features.element_size() + batch[2].numel() * batch[2].element_size() + \
+            batch[3].numel() * batch[3].element_size()
+    return n_bags, n_bytes, time.perf_counter() - start
+
+
+def rates(stage, config, n_bags, n_bytes, seconds):
+    return dict(config, stage=stage, bags=n_bags, seconds=seconds, bags_per_s=n_bags / seconds,
+                mb_per_s=n_bytes / 2 ** 20 / seconds)
+
+
+def run(work_dir, formats, workers, cache_sizes, epochs=2, batch_size=1, **cohort_kwargs):
+    """
+    Bags/s and MB/s of ``__getitem__``, ``collate_MIL_coords`` and a full ``get_split_loader`` epoch for every
+    storage format x cache budget x worker count. Files are read right after they are written, so the numbers
+    are for a warm page cache; later epochs show what the bag cache adds on top.
+    """
+    results = []
+    for fmt in formats:
+        root = os.path.join(work_dir, 'h5' if fmt == 'store' else fmt)
+        csv_path = os.path.join(root, 'cohort.csv')
+        if not os.path.exists(csv_path):
+            make_cohort(root, compression=FORMATS[fmt], **cohort_kwargs)
+        store_dir = None
+        if fmt == 'store':
+            store_dir = os.path.join(work_dir, 'store')
+            if not os.path.exists(os.path.join(store_dir, 'index.csv')):
+                build_feature_store(os.path.join(root, 'h5_coords_files'), store_dir)
+
+        def open_split(cache_bytes):
+            dataset = Generic_MIL_Dataset(csv_path=csv_path, data_dir=root, store_dir=store_dir,
+                                          cache_bytes=cache_bytes, label_dict={0: 0, 1: 1}, print_info=False)
+            return Generic_Split(dataset.slide_data, data_dir=root, num_classes=2, store=dataset.store,
+                                 cache=dataset.cache)
+
+        split = open_split(0)
+        config = {'format': fmt, 'cache_bytes': 0, 'num_workers': 0, 'epoch': 1}
+        results.append(rates('getitem', config, *bench_getitem(split)))
+        results.append(rates('collate_MIL_coords', config, *bench_collate(split)))
+
+        for cache_bytes in cache_sizes:
+            if cache_bytes and fmt == 'store':
+                continue  # the bag cache only fronts the h5 reads
+            for num_workers in workers:
+                split = open_split(cache_bytes)  # every configuration starts with a cold bag cache
+                for epoch in range(1, epochs + 1):
+                    config = {'format': fmt, 'cache_bytes': cache_bytes, 'num_workers': num_workers, 'epoch': epoch}
+                    results.append(rates('get_split_loader', config, *bench_loader(split, num_workers, batch_size)))
+                    print("{format:<8} cache={cache_bytes:<11} workers={num_workers:<2} epoch={epoch}  {bags_per_s:8.1f} bags/s  "
+                          "{mb_per_s:8.1f} MB/s".format(**results[-1]))
+                if split.cache is not None:
+                    split.cache.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Throughput of the Generic_MIL_Dataset data path on a synthetic cohort')
+    parser.add_argument('--work_dir', type=str, default='./benchmarks/synthetic_cohort')
+    parser.add_argument('--formats', type=str, nargs='+', default=list(FORMATS), choices=list(FORMATS))
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--cache_mb', type=int, nargs='+', default=[0, 4096], help='bag cache budgets, 0 disables the cache')
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--n_slides', type=int, default=64)
+    parser.add_argument('--min_patches', type=int, default=1000)
+    parser.add_argument('--max_patches', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--output', type=str, default='./benchmarks/results/bench_dataloader.json')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic cohort for the next run')
+    args = parser.parse_args()
+
+    try:
+        results = run(args.work_dir, args.formats, args.workers, [mb << 20 for mb in args.cache_mb], args.epochs,
+                      args.batch_size, n_slides=args.n_slides, min_patches=args.min_patches,
+                      max_patches=args.max_patches, dim=args.dim)
+    finally:
+        if not args.keep:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'torch': torch.__version__, 'cpu_count': os.cpu_count(),
+                   'platform': platform.platform(), 'n_slides': args.n_slides, 'min_patches': args.min_patches,
+                   'max_patches': args.max_patches, 'dim': args.dim, 'results': results}, f, indent=2)
+    print("Saved {} results to {}".format(len(results), args.output))
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import subprocess
+import importlib
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# name -> (module, class, constructor kwargs given the feature dim, index of the logits used for the backward loss,
+#          feature dims the model accepts or None for any)
+MODELS = {
+    'AttriMIL': ('models.AttriMIL', 'AttriMIL', lambda dim: {'n_classes': 2}, 0, [1536]),
+    'ABMIL': ('models.ABMIL', 'ABMIL', lambda dim: {'n_classes': 2, 'dim': dim}, 0, None),
+    'ABMIL_MB': ('models.ABMIL', 'ABMIL_MB', lambda dim: {'n_classes': 2, 'dim': dim}, 0, None),
+    'DSMIL': ('models.DSMIL', 'MILNet', lambda dim: {'feature_dim': dim, 'n_classes': 2}, 1, None),
+    'TransMIL': ('models.TransMIL', 'TransMIL', lambda dim: {'dim': dim, 'n_classes': 2}, 0, None),
+    'S4MIL': ('models.S4MIL', 'S4Model', lambda dim: {'in_dim': dim, 'n_classes': 2, 'dropout': 0., 'act': 'gelu'}, 0, None),
+    'MIL_MeanPooling': ('models.MIL', 'MIL_MeanPooling', lambda dim: {'n_classes': 2, 'embed_dim': dim}, 0, None),
+    'MIL_MaxPooling': ('models.MIL', 'MIL_MaxPooling', lambda dim: {'n_classes': 2, 'embed_dim': dim}, 0, None),
+    'MIL_RNN': ('models.MIL', 'MIL_RNN', lambda dim: {'n_classes': 2, 'embed_dim': dim}, 0, None),
+}
+DEFAULT_SIZES = [100, 1000, 10000, 50000, 200000]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def timed(fn, warmup, repeats):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_case(model_name, n, dim, warmup=1, repeats=3, seed=0, threads=None):
+    """Forward (eval, no_grad) and forward+backward (train) timings of one model on one synthetic N x dim bag."""
+    if threads:
+        torch.set_num_threads(threads)
+    torch.manual_seed(seed)
+    module, cls, kwargs, logits_idx, _ = MODELS[model_name]
+    model = getattr(importlib.import_module(module), cls)(**kwargs(dim))
+    bag = torch.randn(n, dim)
+    label = torch.tensor([1])
+    baseline_rss = peak_rss_mb()
+
+    def forward():
+        with torch.no_grad():
+            model(bag)
+
+    def forward_backward():
+        model.zero_grad(set_to_none=True)
+        logits = model(bag)[logits_idx].reshape(1, -1)
+        F.cross_entropy(logits, label).backward()
+
+    model.eval()
+    forward_times = timed(forward, warmup, repeats)
+    forward_rss = peak_rss_mb()
+    model.train()
+    backward_times = timed(forward_backward, warmup, repeats)
+    forward_ms, train_ms = 1e3 * float(np.median(forward_times)), 1e3 * float(np.median(backward_times))
+    return {'forward_ms': forward_ms, 'forward_patches_per_s': n / forward_ms * 1e3,
+            'train_step_ms': train_ms, 'train_patches_per_s': n / train_ms * 1e3,
+            'baseline_rss_mb': baseline_rss, 'forward_peak_rss_mb': forward_rss, 'peak_rss_mb': peak_rss_mb(),
+            'n_parameters': sum(p.numel() for p in model.parameters())}
+
+
+def run_isolated(case, timeout):
+    """Run a case in a fresh interpreter, so its peak RSS is its own and a crash or timeout only loses that case."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--_case', json.dumps(case)]
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'status': 'timeout after {}s'.format(timeout)}
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        error = proc.stderr.strip().splitlines()
+        return {'status': 'failed: {}'.format(error[-1] if error else proc.returncode)}
+    return dict(json.loads(lines[-1]), status='ok')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path, threshold=1.10):
+    """Print the cases whose forward or train latency grew by more than ``threshold`` against a baseline file."""
+    with open(baseline_path) as f:
+        baseline = {(r['model'], r['n'], r['dim']): r for r in json.load(f)['results'] if r['status'] == 'ok'}
+    regressions = []
+    for r in results:
+        old = baseline.get((r['model'], r['n'], r['dim']))
+        if r['status'] != 'ok' or old is None:
+            continue
+        for key in ['forward_ms', 'train_step_ms']:
+            ratio = r[key] / old[key]
+            if ratio > threshold:
+                regressions.append((r['model'], r['n'], r['dim'], key, ratio))
+                print("REGRESSION {} N={} dim={} {}: {:.2f}x slower".format(r['model'], r['n'], r['dim'], key, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='CPU latency, throughput and peak memory of the MIL models on synthetic bags')
+    parser.add_argument('--models', type=str, nargs='+', default=list(MODELS), choices=list(MODELS))
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='bag sizes N')
+    parser.add_argument('--dims', type=int, nargs='+', default=[512, 1536], help='feature dims')
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    parser.add_argument('--timeout', type=int, default=600, help='seconds per case')
+    parser.add_argument('--output', type=str, default='./benchmarks/results/bench_models.json')
+    parser.add_argument('--baseline', type=str, default=None, help='earlier output to compare against')
+    parser.add_argument('--_case', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._case:
+        print(json.dumps(run_case(**json.loads(args._case))))
+        sys.exit(0)
+
+    results = []
+    for model_name in args.models:
+        dims = MODELS[model_name][4]
+        for dim in args.dims:
+            if dims is not None and dim not in dims:
+                continue
+            for n in args.sizes:
+                case = {'model_name': model_name, 'n': n, 'dim': dim, 'warmup': args.warmup,
+                        'repeats': args.repeats, 'threads': args.threads}
+                result = dict({'model': model_name, 'n': n, 'dim': dim}, **run_isolated(case, args.timeout))
+                results.append(result)
+                if result['status'] == 'ok':
+                    print("{:<16} N={:<7} dim={:<5} forward {:9.1f} ms ({:10.0f} patches/s)  train {:9.1f} ms  peak {:7.0f} MB".format(
+                        model_name, n, dim, result['forward_ms'], result['forward_patches_per_s'],
+                        result['train_step_ms'], result['peak_rss_mb']))
+                else:
+                    print("{:<16} N={:<7} dim={:<5} {}".format(model_name, n, dim, result['status']))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'torch': torch.__version__,
+                   'threads': args.threads or torch.get_num_threads(), 'platform': platform.platform(),
+                   'processor': platform.processor(), 'results': results}, f, indent=2)
+    print("Saved {} results to {}".format(len(results), args.output))
+    if args.baseline:
+        compare(results, args.baseline)
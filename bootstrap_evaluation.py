@@ -1,9 +1,72 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
-from sklearn.metrics import roc_auc_score, accuracy_score, f1_score, precision_score, recall_score
+from scipy.stats import rankdata
 from tqdm import tqdm
 
-def calculate_bootstrap_metrics(csv_path, n_iterations=1000):
+METRICS = ['auc', 'acc', 'f1', 'prec', 'rec']
+METRIC_NAMES = {'auc': 'AUC-ROC', 'acc': 'Accuracy', 'f1': 'F1-Score', 'prec': 'Precision', 'rec': 'Recall'}
+
+
+def bootstrap_indices(n_samples, n_iterations=1000, seed=42):
+    """All B x N resample index rows in one draw."""
+    return np.random.RandomState(seed).randint(0, n_samples, size=(n_iterations, n_samples))
+
+
+def _batched_metrics(y_true, y_prob, y_pred, indices):
+    """
+    Binary metrics of every resample row of ``indices`` (B x N): AUC from the Mann-Whitney rank sum with
+    average ranks for ties, the rest from batched confusion counts. They match roc_auc_score, accuracy_score,
+    f1_score(average='weighted'), precision_score(zero_division=0) and recall_score. Rows with one class are dropped.
+    """
+    t = y_true[indices] == 1
+    n = indices.shape[1]
+    n_pos = t.sum(axis=1)
+    n_neg = n - n_pos
+    valid = (n_pos > 0) & (n_neg > 0)
+    t, n_pos, n_neg = t[valid], n_pos[valid], n_neg[valid]
+    indices = indices[valid]
+
+    ranks = rankdata(y_prob[indices], axis=1)
+    auc = ((ranks * t).sum(axis=1) - n_pos * (n_pos + 1) / 2.) / (n_pos * n_neg)
+
+    p = y_pred[indices] == 1
+    tp = (t & p).sum(axis=1)
+    fp = (~t & p).sum(axis=1)
+    fn = (t & ~p).sum(axis=1)
+    tn = n - tp - fp - fn
+    acc = (tp + tn) / n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prec = np.where(tp + fp > 0, tp / (tp + fp), 0.)
+    rec = tp / n_pos
+    f1 = (n_pos * 2 * tp / (2 * tp + fp + fn) + n_neg * 2 * tn / (2 * tn + fn + fp)) / n
+    return np.stack([auc, acc, f1, prec, rec])
+
+
+def bootstrap_metrics(y_true, y_prob, y_pred, n_iterations=1000, seed=42, n_jobs=1, chunk_size=100):
+    """5 x B array (METRICS order) of bootstrapped metrics, optionally computed in ``n_jobs`` processes."""
+    indices = bootstrap_indices(len(y_true), n_iterations, seed)
+    chunks = [indices[i: i + chunk_size] for i in range(0, n_iterations, chunk_size)]
+    if n_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_batched_metrics, *zip(*[(y_true, y_prob, y_pred, c) for c in chunks])))
+    else:
+        results = [_batched_metrics(y_true, y_prob, y_pred, c) for c in tqdm(chunks)]
+    return np.concatenate(results, axis=1)
+
+
+def summarise(values, ci=0.95):
+    """mean, std and percentile CI of every metric row; all nan when every resample had a single class."""
+    if values.shape[1] == 0:
+        nan = np.full(len(METRICS), np.nan)
+        return pd.DataFrame({'mean': nan, 'std': nan, 'ci_low': nan, 'ci_high': nan}, index=METRICS)
+    low, high = np.percentile(values, [50 * (1 - ci), 50 * (1 + ci)], axis=1)
+    return pd.DataFrame({'mean': values.mean(axis=1), 'std': values.std(axis=1), 'ci_low': low, 'ci_high': high},
+                        index=METRICS)
+
+
+def calculate_bootstrap_metrics(csv_path, n_iterations=1000, seed=42, ci=0.95, n_jobs=1):
     try:
         df = pd.read_csv(csv_path)
     except FileNotFoundError:
@@ -12,40 +75,31 @@ def calculate_bootstrap_metrics(csv_path, n_iterations=1000):
     y_true_all = df['Y'].values
     y_pred_all = df['Y_hat'].values
     y_prob_all = df['p_1'].values # احتمال کلاس ۱ برای محاسبه AUC
-    
-    bootstrapped_auc = []
-    bootstrapped_acc = []
-    bootstrapped_f1 = []
-    bootstrapped_prec = []
-    bootstrapped_rec = []
-
-    n_samples = len(y_true_all)
 
-    np.random.seed(42)
+    result = summarise(bootstrap_metrics(y_true_all, y_prob_all, y_pred_all, n_iterations, seed, n_jobs), ci)
 
-    for i in tqdm(range(n_iterations)):
-        indices = np.random.choice(range(n_samples), size=n_samples, replace=True)
-        
-        y_true_boot = y_true_all[indices]
-        y_prob_boot = y_prob_all[indices]
-        y_pred_boot = y_pred_all[indices]
+    print("-" * 50)
+    for metric in METRICS:
+        row = result.loc[metric]
+        print(f"{METRIC_NAMES[metric] + ':':<11}{row['mean']:.4f} ± {row['std']:.4f}   "
+              f"({ci:.0%} CI {row['ci_low']:.4f}-{row['ci_high']:.4f})")
+    print("-" * 50)
+    return result
 
-        if len(np.unique(y_true_boot)) < 2:
-            continue
 
-        bootstrapped_auc.append(roc_auc_score(y_true_boot, y_prob_boot))
-        bootstrapped_acc.append(accuracy_score(y_true_boot, y_pred_boot))
-        bootstrapped_f1.append(f1_score(y_true_boot, y_pred_boot, average='weighted'))
-        bootstrapped_prec.append(precision_score(y_true_boot, y_pred_boot, zero_division=0))
-        bootstrapped_rec.append(recall_score(y_true_boot, y_pred_boot))
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bootstrap confidence intervals of fold_k.csv predictions")
+    parser.add_argument('--csv_path', type=str, nargs='+',
+                        default=['/content/AttriMIL-LungCancer/evaluation_results/fold_0.csv'])
+    parser.add_argument('--n_iterations', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--ci', type=float, default=0.95, help='percentile confidence level')
+    parser.add_argument('--n_jobs', type=int, default=1, help='worker processes for the resample chunks')
+    return parser.parse_args()
 
-    print("-" * 50)
-    print(f"AUC-ROC:   {np.mean(bootstrapped_auc):.4f} ± {np.std(bootstrapped_auc):.4f}")
-    print(f"Accuracy:  {np.mean(bootstrapped_acc):.4f} ± {np.std(bootstrapped_acc):.4f}")
-    print(f"F1-Score:  {np.mean(bootstrapped_f1):.4f} ± {np.std(bootstrapped_f1):.4f}")
-    print(f"Precision: {np.mean(bootstrapped_prec):.4f} ± {np.std(bootstrapped_prec):.4f}")
-    print(f"Recall:    {np.mean(bootstrapped_rec):.4f} ± {np.std(bootstrapped_rec):.4f}")
-    print("-" * 50)
 
 if __name__ == "__main__":
-    calculate_bootstrap_metrics(csv_path='/content/AttriMIL-LungCancer/evaluation_results/fold_0.csv', n_iterations=1000)
\ No newline at end of file
+    args = parse_args()
+    for csv_path in args.csv_path:
+        print(csv_path)
+        calculate_bootstrap_metrics(csv_path, args.n_iterations, args.seed, args.ci, args.n_jobs)
@@ -0,0 +1,86 @@
+import re
+import numpy as np
+
+NEGATION_WORDS = ['no', 'not', 'without', 'absence of', 'free of', 'negative for', 'non']
+TOKEN = re.compile(r'[a-z]+')
+
+
+class ConceptMatcher(object):
+    """
+    Every concept of ``mapping`` ({concept: 'word|word|...'}) matched against a report in one token scan.
+
+    Reports are the cleaned text of extract_text_from_pdfs (lowercase letters and whitespace). On such text
+    this is equivalent to the per-concept regexes ``\\b(pattern)\\b`` for a hit and
+    ``\\b(no|not|...)\\b(?:\\s+\\w+){0,4}\\s*(pattern)\\b`` for a negation. A concept is hit when a token
+    equals one of its words. It is negated when one of its words equals one of the ``window + 1`` tokens after a
+    negation phrase, or ends one of the first ``window`` of them (the regex's last ``\\w+`` may stop inside a
+    token). The hyphenated ``non-``/``un-`` form cannot occur in cleaned text.
+    """
+    def __init__(self, mapping, negation_words=NEGATION_WORDS, window=4):
+        self.concepts = list(mapping)
+        self.window = window
+        self.words = {}
+        for k, pattern in enumerate(mapping.values()):
+            for word in pattern.split('|'):
+                if not re.fullmatch(r'[a-z]+', word):
+                    raise ValueError("only single lowercase words are supported, got {!r}".format(word))
+                self.words.setdefault(word, set()).add(k)
+        self.lengths = sorted(set(len(word) for word in self.words))
+        self._suffixes = {}
+        # negation phrases by their last word, the token a scan stops at
+        self.negations = {}
+        for phrase in negation_words:
+            phrase = tuple(phrase.split(' '))
+            self.negations.setdefault(phrase[-1], []).append(phrase)
+
+    def _suffix_concepts(self, token):
+        if token not in self._suffixes:
+            found = set()
+            for length in self.lengths:
+                if length >= len(token):
+                    break
+                found |= self.words.get(token[-length:], set())
+            self._suffixes[token] = found
+        return self._suffixes[token]
+
+    def _negated_phrase(self, text, tokens, spans, end):
+        for phrase in self.negations[tokens[end]]:
+            start = end - len(phrase) + 1
+            if start < 0 or tuple(tokens[start: end + 1]) != phrase:
+                continue
+            if len(phrase) == 1:
+                return True
+            # the words of a multi-word phrase are separated by exactly one space in the regex
+            if all(text[spans[i][1]: spans[i + 1][0]] == ' ' for i in range(start, end)):
+                return True
+        return False
+
+    def match(self, text):
+        """(hit, negated) boolean vectors over ``self.concepts`` for one report."""
+        matches = list(TOKEN.finditer(text))
+        tokens = [m.group() for m in matches]
+        spans = [m.span() for m in matches]
+        hit = np.zeros(len(self.concepts), dtype=bool)
+        negated = np.zeros(len(self.concepts), dtype=bool)
+        found = set().union(*[self.words[word] for word in self.words.keys() & set(tokens)])
+        if not found:
+            return hit, negated
+        hit[list(found)] = True
+
+        negated_concepts = set()
+        for end, token in enumerate(tokens):
+            if token not in self.negations or not self._negated_phrase(text, tokens, spans, end):
+                continue
+            for j in range(end + 1, min(end + self.window + 2, len(tokens))):
+                negated_concepts |= self.words.get(tokens[j], set())
+                if j <= end + self.window:
+                    negated_concepts |= self._suffix_concepts(tokens[j])
+        negated[list(negated_concepts & found)] = True
+        return hit, negated
+
+    def match_many(self, texts):
+        """R x C (hit, negated) matrices for an iterable of reports."""
+        results = [self.match(text) for text in texts]
+        if not results:
+            return np.zeros((0, len(self.concepts)), dtype=bool), np.zeros((0, len(self.concepts)), dtype=bool)
+        return np.stack([hit for hit, _ in results]), np.stack([negated for _, negated in results])
@@ -0,0 +1,57 @@
+import numpy as np
+from scipy.stats import t as t_dist
+
+
+def _standardise(x):
+    """Column-centred x divided by its norm; constant columns become zero."""
+    x = np.asarray(x, dtype=np.float64)
+    x = x - x.mean(axis=0)
+    norm = np.sqrt((x ** 2).sum(axis=0))
+    return np.divide(x, norm, out=np.zeros_like(x), where=norm > 0), norm > 0
+
+
+def pointbiserial_matrix(binary, continuous):
+    """
+    Point-biserial (Pearson) r and two-sided p-value of every binary column against every continuous column,
+    from one matrix product of the standardised columns. binary: n x F, continuous: n x B; returns F x B arrays.
+    Constant binary columns get r = 0 and p = 1, as the per-pair pointbiserialr loop gave them.
+    """
+    xs, x_ok = _standardise(binary)
+    ys, y_ok = _standardise(continuous)
+    n = xs.shape[0]
+    r = np.clip(xs.T @ ys, -1., 1.)
+    with np.errstate(divide='ignore'):
+        t = r * np.sqrt((n - 2) / np.maximum(1. - r ** 2, 0.))
+    p = 2 * t_dist.sf(np.abs(t), n - 2)
+    valid = x_ok[:, None] & y_ok[None, :]
+    return np.where(valid, r, 0.), np.where(valid, p, 1.)
+
+
+def permutation_pvalues(binary, continuous, n_permutations=1000, seed=0, batch_size=100):
+    """
+    Permutation p-values of |r|: the continuous rows are shuffled jointly (one permutation for all pairs)
+    and the correlations of a batch of permutations come from one batched matrix product.
+    """
+    xs, _ = _standardise(binary)
+    ys, _ = _standardise(continuous)
+    observed = np.abs(xs.T @ ys)
+    rng = np.random.RandomState(seed)
+    exceed = np.zeros_like(observed)
+    for start in range(0, n_permutations, batch_size):
+        size = min(batch_size, n_permutations - start)
+        perms = np.stack([rng.permutation(len(ys)) for _ in range(size)])
+        r_perm = np.einsum('nf,pnb->pfb', xs, ys[perms])  # P x F x B
+        exceed += (np.abs(r_perm) >= observed - 1e-12).sum(axis=0)
+    return (exceed + 1) / (n_permutations + 1)
+
+
+def bh_fdr(p):
+    """Benjamini-Hochberg q-values of an array of p-values (any shape)."""
+    p = np.asarray(p, dtype=np.float64)
+    flat = p.ravel()
+    order = np.argsort(flat)
+    ranked = flat[order] * len(flat) / np.arange(1, len(flat) + 1)
+    q = np.minimum.accumulate(ranked[::-1])[::-1]
+    out = np.empty_like(flat)
+    out[order] = np.minimum(q, 1.)
+    return out.reshape(p.shape)
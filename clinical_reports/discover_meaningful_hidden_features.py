@@ -1,10 +1,8 @@
-import os
-import re
-import PyPDF2
-from tqdm import tqdm
-from collections import defaultdict
+from pdf_text_cache import load_report_texts
+import pandas as pd
+from term_matrix import TermMatrix
 
-def discover_meaningful_hidden_features(reports_dir):
+def discover_meaningful_hidden_features(reports_dir, low=15, high=180, top=20, ngram_range=(1, 1), labels_csv=None):
     
     TARGET_FEATURES = {
         'glandular', 'glands', 'acinar', 'acini', 'adenocarcinoma', 'aca', 'nsclc',
@@ -29,42 +27,28 @@ def discover_meaningful_hidden_features(reports_dir):
         'excision', 'greatest', 'hilar', 'pathology', 'x', 'p', 't', 'n', 'm'
     }
 
-    doc_frequency = defaultdict(int)
-    total_docs = 0
+    reports = {filename: text for filename, text in load_report_texts(reports_dir).items() if text.strip()}
+    total_docs = len(reports)
+    dtm = TermMatrix(reports.values(), doc_ids=list(reports), ngram_range=ngram_range,
+                     stop_words=ADMIN_WORDS | TARGET_FEATURES)
 
-    for filename in tqdm(os.listdir(reports_dir)):
-        if filename.upper().endswith(".PDF"):
-            filepath = os.path.join(reports_dir, filename)
-            text = ""
-            try:
-                with open(filepath, 'rb') as file:
-                    reader = PyPDF2.PdfReader(file)
-                    for page in reader.pages:
-                        extracted = page.extract_text()
-                        if extracted:
-                            text += extracted + " "
-            except Exception:
-                continue
-            
-            if text.strip():
-                total_docs += 1
-                clean_text = re.sub(r'[^a-zA-Z\s]', ' ', text.lower())
-                words = clean_text.split()
-                
-                valid_words = [w for w in words if len(w) > 3 and w not in ADMIN_WORDS and w not in TARGET_FEATURES]
-                
-                unique_words_in_doc = set(valid_words)
-                for w in unique_words_in_doc:
-                    doc_frequency[w] += 1
+    sorted_words = dtm.frequency_band(low, high)
 
-    meaningful_words = {word: count for word, count in doc_frequency.items() if 15 <= count <= 180}
-    
-    sorted_words = sorted(meaningful_words.items(), key=lambda item: item[1], reverse=True)
-
-    print(f"\n\n💎 ۲۰ کلمه‌ی مهمِ جا مانده (با فیلتر فرکانسِ طلایی بین 15 تا 180 از {total_docs} گزارش):")
-    for word, count in sorted_words[:20]:
+    print(f"\n\n💎 {top} کلمه‌ی مهمِ جا مانده (با فیلتر فرکانسِ طلایی بین {low} تا {high} از {total_docs} گزارش):")
+    for word, count in sorted_words.head(top).itertuples(index=False):
         print(f" - {word}: در {count} گزارش حضور داشت")
 
+    if labels_csv:
+        # LUAD vs LUSC enrichment; reports are matched to labels by case id
+        df = pd.read_csv(labels_csv)
+        case_labels = dict(zip(df['slide_id'].apply(lambda x: "-".join(str(x).split("-")[:3])), df['true_label']))
+        enrichment = dtm.enrichment([case_labels.get(filename.split('_')[0]) for filename in dtm.doc_ids], min_df=low)
+        print("\nEnriched in label {}:".format(enrichment.columns[2][3:]))
+        print(enrichment.head(top).to_string(index=False))
+        print("\nEnriched in label {}:".format(enrichment.columns[1][3:]))
+        print(enrichment.iloc[::-1].head(top).to_string(index=False))
+    return sorted_words
+
 if __name__ == "__main__":
     reports_folder = '/content/AttriMIL-LungCancer/tcga_reports'
     discover_meaningful_hidden_features(reports_folder)
\ No newline at end of file
@@ -1,9 +1,12 @@
-import requests
 import os
+import sys
+import requests
 import pandas as pd
-from tqdm import tqdm
 
-def download_tcga_pathology_reports(csv_path, output_dir="tcga_reports"):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gdc_client import GDCClient
+
+def download_tcga_pathology_reports(csv_path, output_dir="tcga_reports", client=None):
     try:
         df = pd.read_csv(csv_path)
     except Exception as e:
@@ -19,7 +22,7 @@ def download_tcga_pathology_reports(csv_path, output_dir="tcga_reports"):
     if len(unique_cases) == 0:
         return
 
-    endpoint = "https://api.gdc.cancer.gov/files"
+    client = client or GDCClient()
     
     filters = {
         "op": "and",
@@ -41,49 +44,27 @@ def download_tcga_pathology_reports(csv_path, output_dir="tcga_reports"):
         ]
     }
     
-    payload = {
-        "filters": filters,
-        "fields": "file_id,file_name,cases.submitter_id",
-        "format": "JSON",
-        "size": "1000"
-    }
-    
-    response = requests.post(endpoint, json=payload)
-    
-    if response.status_code != 200:
-        print(f"GDC Server Error: {response.status_code}")
-        print(f"{response.text}")
-        return
-        
     try:
-        data = response.json()
-    except Exception as e:
+        hits = client.query("files", filters, "file_id,file_name,md5sum,cases.submitter_id")
+    except requests.HTTPError as e:
+        print(f"GDC Server Error: {e.response.status_code}")
+        print(f"{e.response.text}")
+        return
+    except (requests.RequestException, ValueError, KeyError):
         return
     
-    if "data" not in data or "hits" not in data["data"] or len(data["data"]["hits"]) == 0:
+    if len(hits) == 0:
         return
         
-    hits = data["data"]["hits"]
-    
     os.makedirs(output_dir, exist_ok=True)
-    data_endpoint = "https://api.gdc.cancer.gov/data/"
     
-    for hit in tqdm(hits, desc="Downloading PDFs"):
-        file_id = hit["file_id"]
-        file_name = hit["file_name"]
-        
+    jobs = []
+    for hit in hits:
         case_id = hit.get("cases", [{}])[0].get("submitter_id", "UNKNOWN")
-        
-        save_name = f"{case_id}_{file_name}"
-        save_path = os.path.join(output_dir, save_name)
-        
-        if not os.path.exists(save_path):
-            file_url = data_endpoint + file_id
-            r = requests.get(file_url, stream=True)
-            if r.status_code == 200:
-                with open(save_path, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
+        save_name = f"{case_id}_{hit['file_name']}"
+        jobs.append((hit["file_id"], os.path.join(output_dir, save_name), hit.get("md5sum")))
+    
+    return client.download_many(jobs, manifest_path=os.path.join(output_dir, "manifest.csv"), desc="Downloading PDFs")
             
 if __name__ == "__main__":
     csv_file_path = '/content/AttriMIL-LungCancer/evaluation_results/extracted_visual_scores.csv'
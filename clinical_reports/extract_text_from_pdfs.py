@@ -1,41 +1,18 @@
-import os
 import re
 import pandas as pd
-import PyPDF2
-from tqdm import tqdm
+from pdf_text_cache import load_report_texts
+from concept_matcher import ConceptMatcher
 
-def extract_text_from_pdfs(reports_dir):
+def extract_text_from_pdfs(reports_dir, cache_path=None, workers=None):
     reports = {}
-    for filename in tqdm(os.listdir(reports_dir)):
-        if filename.upper().endswith(".PDF"):
-            case_id = filename.split('_')[0]
-            filepath = os.path.join(reports_dir, filename)
-            text = ""
-            try:
-                with open(filepath, 'rb') as file:
-                    reader = PyPDF2.PdfReader(file)
-                    for page in reader.pages:
-                        extracted = page.extract_text()
-                        if extracted:
-                            text += extracted + " "
-            except Exception:
-                continue
-            
-            if text.strip():
-                clean_text = re.sub(r'[^a-zA-Z\s]', ' ', text.lower())
-                reports[case_id] = clean_text
+    for filename, text in load_report_texts(reports_dir, cache_path, workers).items():
+        case_id = filename.split('_')[0]
+        
+        if text.strip():
+            clean_text = re.sub(r'[^a-zA-Z\s]', ' ', text.lower())
+            reports[case_id] = clean_text
     return reports
 
-def is_negated(feature_pattern, raw_text):
-    negation_words = r'(no|not|without|absence of|free of|negative for|non)'
-    
-    pattern = r'\b' + negation_words + r'\b(?:\s+\w+){0,4}\s*(' + feature_pattern + r')\b'
-    hyphen_pattern = r'\b(non|un)-(' + feature_pattern + r')\b'
-    
-    if re.search(pattern, raw_text) or re.search(hyphen_pattern, raw_text):
-        return True
-    return False
-
 def build_ultimate_semantic_matrix(visual_scores_path, reports_dir, output_csv_path):
     reports_data = extract_text_from_pdfs(reports_dir)
     if not reports_data:
@@ -70,17 +47,15 @@ def build_ultimate_semantic_matrix(visual_scores_path, reports_dir, output_csv_p
         df[concept_name] = 0
         df[f"absence_of_{concept_name}"] = 0
         
-    for index, row in df.iterrows():
-        case_id = row['case_id']
-        if case_id in reports_data:
-            text = reports_data[case_id]
-            
-            for concept_name, regex_pattern in TARGET_FEATURES_MAPPING.items():
-                if re.search(r'\b(' + regex_pattern + r')\b', text):
-                    if is_negated(regex_pattern, text):
-                        df.at[index, f"absence_of_{concept_name}"] = 1
-                    else:
-                        df.at[index, concept_name] = 1
+    # every report is scanned once for all concepts, negations included
+    matcher = ConceptMatcher(TARGET_FEATURES_MAPPING)
+    case_ids = list(reports_data)
+    hits, negated = matcher.match_many(reports_data[case_id] for case_id in case_ids)
+    rows = pd.Index(case_ids).get_indexer(df['case_id'])
+    has_report = rows >= 0
+    for k, concept_name in enumerate(matcher.concepts):
+        df.loc[has_report, concept_name] = (hits[rows[has_report], k] & ~negated[rows[has_report], k]).astype(int)
+        df.loc[has_report, f"absence_of_{concept_name}"] = negated[rows[has_report], k].astype(int)
                         
     cols_to_keep = ['slide_id', 'true_label', 'max_attr_LUAD', 'max_attr_LUSC']
     for col in df.columns:
@@ -0,0 +1,63 @@
+import os
+import hashlib
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+import PyPDF2
+from tqdm import tqdm
+
+
+def parse_pdf(filepath):
+    """Raw text of every page, as the clinical scripts extracted it; None when PyPDF2 cannot read the file."""
+    text = ""
+    try:
+        with open(filepath, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            for page in reader.pages:
+                extracted = page.extract_text()
+                if extracted:
+                    text += extracted + " "
+    except Exception:
+        return None
+    return text
+
+
+def file_sha256(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_report_texts(reports_dir, cache_path=None, workers=None):
+    """
+    {filename: raw text} of every readable PDF in ``reports_dir``, in os.listdir order.
+
+    Texts are cached in SQLite (default ``<reports_dir>/.pdf_text_cache.sqlite``) keyed by the sha256 of the
+    PDF bytes, so a report is parsed again only when its content changes; unreadable PDFs are cached as such.
+    Cache misses are parsed by a process pool of ``workers`` processes.
+    """
+    cache_path = cache_path or os.path.join(reports_dir, '.pdf_text_cache.sqlite')
+    filenames = [f for f in os.listdir(reports_dir) if f.upper().endswith(".PDF")]
+    hashes = {f: file_sha256(os.path.join(reports_dir, f)) for f in filenames}
+
+    con = sqlite3.connect(cache_path)
+    with con:
+        con.execute("CREATE TABLE IF NOT EXISTS texts (sha256 TEXT PRIMARY KEY, text TEXT)")
+    cached = {}
+    for sha256, text in con.execute("SELECT sha256, text FROM texts"):
+        cached[sha256] = text
+
+    missing = {}
+    for filename in filenames:
+        if hashes[filename] not in cached:
+            missing.setdefault(hashes[filename], os.path.join(reports_dir, filename))
+    if missing:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            texts = list(tqdm(pool.map(parse_pdf, missing.values(), chunksize=8), total=len(missing), desc="Parsing PDFs"))
+        with con:
+            con.executemany("INSERT OR REPLACE INTO texts VALUES (?, ?)", zip(missing.keys(), texts))
+        cached.update(zip(missing.keys(), texts))
+    con.close()
+
+    return {filename: cached[hashes[filename]] for filename in filenames if cached[hashes[filename]] is not None}
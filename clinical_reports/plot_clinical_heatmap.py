@@ -2,33 +2,35 @@ import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from scipy.stats import pointbiserialr
+from correlation_engine import pointbiserial_matrix, permutation_pvalues, bh_fdr
 
-def plot_ultimate_clinical_heatmap(csv_path, output_path):
+def compute_clinical_correlations(csv_path, visual_branches=('max_attr_LUAD', 'max_attr_LUSC'), n_permutations=0, seed=0):
+    """
+    Point-biserial r and p-value of every clinical concept column against every visual score column, as
+    feature x branch DataFrames {'r', 'p', 'q'} (q: Benjamini-Hochberg). With ``n_permutations`` the
+    permutation p-values and their BH q-values are added as 'p_perm' and 'q_perm'.
+    """
     df = pd.read_csv(csv_path)
+    visual_branches = list(visual_branches)
 
-    df['max_attr_LUAD'] = (df['max_attr_LUAD'] - df['max_attr_LUAD'].min()) / (df['max_attr_LUAD'].max() - df['max_attr_LUAD'].min())
-    df['max_attr_LUSC'] = (df['max_attr_LUSC'] - df['max_attr_LUSC'].min()) / (df['max_attr_LUSC'].max() - df['max_attr_LUSC'].min())
-    
-    fixed_cols = ['slide_id', 'true_label', 'max_attr_LUAD', 'max_attr_LUSC']
+    for branch in visual_branches:
+        df[branch] = (df[branch] - df[branch].min()) / (df[branch].max() - df[branch].min())
+
+    fixed_cols = ['slide_id', 'true_label'] + visual_branches
     clinical_features = [col for col in df.columns if col not in fixed_cols]
-    visual_branches = ['max_attr_LUAD', 'max_attr_LUSC']
-    
-    corr_matrix = np.zeros((len(clinical_features), len(visual_branches)))
-    p_matrix = np.zeros((len(clinical_features), len(visual_branches)))
 
-    for i, feature in enumerate(clinical_features):
-        for j, branch in enumerate(visual_branches):
-            binary_data = df[feature].values
-            continuous_data = df[branch].values
-            
-            if len(np.unique(binary_data)) > 1:
-                corr, p_val = pointbiserialr(binary_data, continuous_data)
-                corr_matrix[i, j] = corr
-                p_matrix[i, j] = p_val
-            else:
-                corr_matrix[i, j] = 0
-                p_matrix[i, j] = 1.0
+    binary_data = df[clinical_features].values
+    continuous_data = df[visual_branches].values
+    corr_matrix, p_matrix = pointbiserial_matrix(binary_data, continuous_data)
+    results = {'r': corr_matrix, 'p': p_matrix, 'q': bh_fdr(p_matrix)}
+    if n_permutations:
+        results['p_perm'] = permutation_pvalues(binary_data, continuous_data, n_permutations, seed)
+        results['q_perm'] = bh_fdr(results['p_perm'])
+    return {key: pd.DataFrame(value, index=clinical_features, columns=visual_branches) for key, value in results.items()}
+
+def plot_correlation_heatmap(corr, p_values, output_path, branch_labels=('LUAD Visual Score', 'LUSC Visual Score'), show=True):
+    corr_matrix, p_matrix = corr.values, p_values.values
+    clinical_features, visual_branches = list(corr.index), list(corr.columns)
 
     labels = []
     for i in range(len(clinical_features)):
@@ -59,14 +61,20 @@ def plot_ultimate_clinical_heatmap(csv_path, output_path):
     )
 
     ax.set_yticklabels(clinical_features, rotation=0, fontsize=10)
-    ax.set_xticklabels(['LUAD Visual Score', 'LUSC Visual Score'], fontsize=12, fontweight='bold')
+    ax.set_xticklabels(list(branch_labels), fontsize=12, fontweight='bold')
     
     plt.title('Clinical Validation: Visual-Language Alignment\n(Stars indicate statistical significance: *p<0.05, **p<0.01, ***p<0.001)', 
               fontsize=14, pad=20, fontweight='bold')
     
     plt.tight_layout()
     plt.savefig(output_path, dpi=300, bbox_inches='tight')
-    plt.show()
+    if show:
+        plt.show()
+
+def plot_ultimate_clinical_heatmap(csv_path, output_path, n_permutations=0, significance='p'):
+    """Computes the correlations, then plots them; stars follow ``significance`` ('p', 'q', 'p_perm' or 'q_perm')."""
+    results = compute_clinical_correlations(csv_path, n_permutations=n_permutations)
+    plot_correlation_heatmap(results['r'], results[significance], output_path)
 
 if __name__ == "__main__":
     plot_ultimate_clinical_heatmap(
@@ -0,0 +1,92 @@
+import re
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import norm
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+
+def clean_words(text):
+    """The words of a report as the clinical scripts see them: lowercase letters only."""
+    return re.sub(r'[^a-zA-Z\s]', ' ', text.lower()).split()
+
+
+class TermMatrix(object):
+    """
+    Sparse document-term count matrix of a set of reports.
+
+    Words shorter than ``min_len`` characters or in ``stop_words`` are dropped before n-grams are formed, so
+    ``ngram_range=(1, 2)`` adds bigrams of consecutive kept words.
+    """
+    def __init__(self, texts, doc_ids=None, ngram_range=(1, 1), min_len=4, stop_words=()):
+        stop_words = set(stop_words)
+
+        def tokenize(text):
+            return [w for w in clean_words(text) if len(w) >= min_len and w not in stop_words]
+
+        texts = list(texts)
+        self.doc_ids = np.asarray(doc_ids if doc_ids is not None else range(len(texts)))
+        self.vectorizer = CountVectorizer(tokenizer=tokenize, lowercase=False, token_pattern=None,
+                                          ngram_range=ngram_range)
+        try:
+            self.counts = self.vectorizer.fit_transform(texts).tocsr()
+            self.terms = self.vectorizer.get_feature_names_out()
+        except ValueError:  # no report has a single kept word
+            self.counts = sparse.csr_matrix((len(texts), 0), dtype=np.int64)
+            self.terms = np.array([], dtype=object)
+
+    def __len__(self):
+        return self.counts.shape[0]
+
+    def presence(self):
+        present = self.counts.copy()
+        present.data[:] = 1
+        return present
+
+    def document_frequency(self):
+        """Number of reports containing every term."""
+        return np.bincount(self.counts.indices, minlength=len(self.terms))
+
+    def frequency_band(self, low, high):
+        """Terms whose document frequency lies in [low, high], most frequent first."""
+        df = pd.DataFrame({'term': self.terms, 'df': self.document_frequency()})
+        df = df[(df['df'] >= low) & (df['df'] <= high)]
+        return df.sort_values(['df', 'term'], ascending=[False, True]).reset_index(drop=True)
+
+    def tfidf(self, **kwargs):
+        """Sparse TF-IDF weights (sklearn TfidfTransformer) of the count matrix."""
+        return TfidfTransformer(**kwargs).fit_transform(self.counts)
+
+    def top_tfidf(self, k=20, **kwargs):
+        """The ``k`` terms with the highest mean TF-IDF weight over the reports."""
+        weight = np.asarray(self.tfidf(**kwargs).mean(axis=0)).ravel()
+        order = np.argsort(-weight, kind='stable')[:k]
+        return pd.DataFrame({'term': self.terms[order], 'mean_tfidf': weight[order]})
+
+    def enrichment(self, labels, min_df=1):
+        """
+        Term enrichment between the two groups of ``labels`` (one per report, e.g. LUAD/LUSC, None for unlabelled
+        reports): document frequency per group, the smoothed log odds ratio of group 1 vs group 0 and a
+        two-proportion z-test p-value.
+        """
+        labels = pd.Series(np.asarray(labels, dtype=object))
+        known = labels.notna().values  # reports without a label are left out
+        labels = labels[known].values
+        groups = np.unique(labels)
+        if len(groups) != 2:
+            raise ValueError("enrichment needs exactly two label groups, got {}".format(list(groups)))
+        onehot = sparse.csr_matrix(np.stack([labels == g for g in groups], axis=1).astype(np.int64))
+        group_df = np.asarray((onehot.T @ self.presence()[known]).todense())  # 2 x terms
+        n = onehot.sum(axis=0).A1[:, None]
+
+        odds = (group_df + 0.5) / (n - group_df + 0.5)
+        log_odds = np.log(odds[1] / odds[0])
+        p_pool = group_df.sum(axis=0) / n.sum()
+        se = np.sqrt(p_pool * (1 - p_pool) * (1. / n[0, 0] + 1. / n[1, 0]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = np.where(se > 0, (group_df[1] / n[1, 0] - group_df[0] / n[0, 0]) / se, 0.)
+        result = pd.DataFrame({'term': self.terms,
+                               'df_{}'.format(groups[0]): group_df[0], 'df_{}'.format(groups[1]): group_df[1],
+                               'log_odds': log_odds, 'z': z, 'p_value': 2 * norm.sf(np.abs(z))})
+        result = result[group_df.sum(axis=0) >= min_df]
+        return result.sort_values('log_odds', ascending=False).reset_index(drop=True)
@@ -1,109 +1,153 @@
 import os
 import argparse
-import pandas as pd
-import matplotlib.pyplot as plt
-import requests
-import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from matplotlib.figure import Figure
 import openslide
+from patch_index import PatchIndex
+from gdc_client import GDCClient
 
 
-def auto_download_slide(slide_id, save_dir):
+def auto_download_slide(slide_id, save_dir, client=None):
     os.makedirs(save_dir, exist_ok=True)
     save_path = os.path.join(save_dir, f"{slide_id}.svs")
     
     if os.path.exists(save_path):
         return save_path
             
+    client = client or GDCClient()
     file_name = f"{slide_id}.svs"
-    payload = {
-        "filters": json.dumps({
-            "op": "=",
-            "content": {"field": "file_name", "value": file_name}
-        }),
-        "fields": "file_id",
-        "format": "JSON"
+    filters = {
+        "op": "=",
+        "content": {"field": "file_name", "value": file_name}
     }
     
-    file_uuid = None
-    for endpoint in ["https://api.gdc.cancer.gov/files", "https://api.gdc.cancer.gov/legacy/files"]:
+    hit = None
+    for endpoint in ["files", "legacy/files"]:
         try:
-            r = requests.get(endpoint, params=payload)
-            r.raise_for_status()
-            data = r.json()
-            if data.get("data", {}).get("hits"):
-                file_uuid = data["data"]["hits"][0]["file_id"]
+            hits = client.query(endpoint, filters, "file_id,md5sum", max_hits=1)
+            if hits:
+                hit = hits[0]
                 break
         except Exception:
             continue
             
-    if not file_uuid:
+    if not hit:
         return None
         
     
-    dl_url = f"https://api.gdc.cancer.gov/data/{file_uuid}"
     try:
-        response = requests.get(dl_url, stream=True)
-        response.raise_for_status()
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk: f.write(chunk)
-        return save_path
+        # a partial .svs.part from an interrupted run is resumed, not restarted
+        return client.download(hit["file_id"], save_path, hit.get("md5sum"))
     except Exception as e:
-        if os.path.exists(save_path): os.remove(save_path)
         return None 
 
-def render_concept(concept, alignment_csv, master_db_csv, wsi_dir, output_dir, auto_dl=False):
-    df_align = pd.read_csv(alignment_csv)
-    concept_lower = concept.lower()
-    
-    if concept_lower not in df_align.columns:
-        return
-        
-    best_slide_row = df_align.sort_values(by=concept_lower, ascending=False).iloc[0]
-    best_slide_id = best_slide_row['slide_id']
-    
-    raw_label = best_slide_row['true_label']
-    label_map = {0: 'LUAD', 1: 'LUSC', '0': 'LUAD', '1': 'LUSC'}
-    true_label = label_map.get(raw_label, raw_label) 
-    
-    
-    df_db = pd.read_csv(master_db_csv)
-    
-    slide_patches = df_db[(df_db['slide_id'] == best_slide_id) & (df_db['class_branch'] == true_label)]
-    
-    if slide_patches.empty:
-        return
+class RegionCache(object):
+    """Open OpenSlide handles plus an LRU of decoded regions, shared by the render threads."""
+    def __init__(self, max_regions=256):
+        self.max_regions = max_regions
+        self._slides = {}
+        self._regions = OrderedDict()
+        self._lock = threading.Lock()
 
-    wsi_path = os.path.join(wsi_dir, f"{best_slide_id}.svs")
-    if not os.path.exists(wsi_path) and auto_dl:
-        wsi_path = auto_download_slide(best_slide_id, wsi_dir)
-        
-    if not wsi_path or not os.path.exists(wsi_path):
-        return
-        
-    wsi = openslide.OpenSlide(wsi_path)
-    fig, axes = plt.subplots(2, 3, figsize=(15, 10))
+    def slide(self, wsi_path):
+        with self._lock:
+            if wsi_path not in self._slides:
+                self._slides[wsi_path] = openslide.OpenSlide(wsi_path)
+            return self._slides[wsi_path]
+
+    def read_region(self, wsi_path, location, size=(512, 512)):
+        key = (wsi_path, location, size)
+        with self._lock:
+            if key in self._regions:
+                self._regions.move_to_end(key)
+                return self._regions[key]
+        region = self.slide(wsi_path).read_region(location, 0, size).convert('RGB')
+        with self._lock:
+            self._regions[key] = region
+            while len(self._regions) > self.max_regions:
+                self._regions.popitem(last=False)
+        return region
+
+    def close(self):
+        for wsi in self._slides.values():
+            wsi.close()
+        self._slides = {}
+        self._regions.clear()
+
+
+def draw_concept(concept, best_slide_id, slide_patches, wsi_path, output_dir, cache):
+    # a standalone Figure (not pyplot) so several threads can draw at once
+    fig = Figure(figsize=(15, 10))
+    axes = fig.subplots(2, 3)
     
     for row_idx, p_type in enumerate(['TOP', 'BOTTOM']):
-        sub_group = slide_patches[slide_patches['type'] == p_type].sort_values('rank')
+        sub_group = slide_patches[p_type]
         for col_idx in range(min(3, len(sub_group))):
             p_data = sub_group.iloc[col_idx]
             x, y = int(p_data['coord_x']), int(p_data['coord_y'])
-            patch = wsi.read_region((x, y), 0, (512, 512)).convert('RGB')
+            patch = cache.read_region(wsi_path, (x, y), (512, 512))
             axes[row_idx, col_idx].imshow(patch)
-            axes[row_idx, col_idx].set_title(f"{p_type} Rank {p_data['rank']}\nScore: {p_data['score']:.4f}")
+            axes[row_idx, col_idx].set_title(f"{p_type} Rank {int(p_data['rank'])}\nScore: {p_data['score']:.4f}")
             axes[row_idx, col_idx].axis('off')
             
-    plt.suptitle(f"Slide: {best_slide_id[:15]} | Concept: {concept}", fontsize=14)
-    plt.tight_layout()
+    fig.suptitle(f"Slide: {best_slide_id[:15]} | Concept: {concept}", fontsize=14)
+    fig.tight_layout()
     save_path = os.path.join(output_dir, f"{best_slide_id[:15]}_{concept}_vis.png")
-    plt.savefig(save_path)
-    wsi.close()
+    fig.savefig(save_path)
+    return save_path
+
+def render_concepts(concepts, alignment_csv, master_db_csv, wsi_dir, output_dir, auto_dl=False, index=None,
+                    workers=4, cache=None):
+    """
+    Render several concepts in one pass: concepts are grouped by their best slide so every slide is downloaded
+    and opened once, tiles come through a shared region cache and figures are drawn by a thread pool.
+    Returns {concept: saved figure path} for the concepts that could be rendered.
+    """
+    if index is None:
+        index = PatchIndex.open(alignment_csv, master_db_csv)
+    
+    by_slide = OrderedDict()
+    for concept in concepts:
+        best = index.best_slide(concept.lower())
+        if best is None:
+            continue
+        best_slide_id, true_label = best
+        slide_patches = {p_type: index.patches(best_slide_id, true_label, p_type) for p_type in ['TOP', 'BOTTOM']}
+        if all(sub_group.empty for sub_group in slide_patches.values()):
+            continue
+        by_slide.setdefault(best_slide_id, []).append((concept, slide_patches))
+    
+    own_cache = cache is None
+    if own_cache:
+        cache = RegionCache()
+    futures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for best_slide_id, slide_jobs in by_slide.items():
+            wsi_path = os.path.join(wsi_dir, f"{best_slide_id}.svs")
+            if not os.path.exists(wsi_path) and auto_dl:
+                wsi_path = auto_download_slide(best_slide_id, wsi_dir)
+            if not wsi_path or not os.path.exists(wsi_path):
+                continue
+            for concept, slide_patches in slide_jobs:
+                futures.append((concept, pool.submit(draw_concept, concept, best_slide_id, slide_patches,
+                                                     wsi_path, output_dir, cache)))
+    saved = {concept: future.result() for concept, future in futures}
+    if own_cache:
+        cache.close()
+    return saved
+
+def render_concept(concept, alignment_csv, master_db_csv, wsi_dir, output_dir, auto_dl=False, index=None):
+    return render_concepts([concept], alignment_csv, master_db_csv, wsi_dir, output_dir, auto_dl, index,
+                           workers=1).get(concept)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--concept", type=str, required=True)
+    parser.add_argument("--concept", type=str, nargs='+', required=True,
+                        help="one or more concepts, or 'all' for every concept of the alignment table")
     parser.add_argument("--auto_download", action="store_true")
+    parser.add_argument("--workers", type=int, default=4, help="render threads")
     args = parser.parse_args()
     
     ALIGN_CSV = "/content/AttriMIL-LungCancer/evaluation_results/ultimate_alignment_data.csv"
@@ -111,4 +155,6 @@ if __name__ == "__main__":
     WSI_DIR = "/content/wsis/"
     OUT_DIR = "/content/AttriMIL-LungCancer/evaluation_results/visualizations/"
     
-    render_concept(args.concept, ALIGN_CSV, MASTER_DB, WSI_DIR, OUT_DIR, args.auto_download)
\ No newline at end of file
+    index = PatchIndex.open(ALIGN_CSV, MASTER_DB)
+    concepts = index.concepts() if args.concept == ['all'] else args.concept
+    render_concepts(concepts, ALIGN_CSV, MASTER_DB, WSI_DIR, OUT_DIR, args.auto_download, index, args.workers)
\ No newline at end of file
@@ -2,61 +2,101 @@ import numpy as np
 import torch
 from utils import *
 import os
-import queue
 from sklearn.preprocessing import label_binarize
 from sklearn.metrics import roc_auc_score, roc_curve
 from sklearn.metrics import auc as calc_auc
 
 
-def spatial_constraint(A, n_classes, nearest, ks=3):
-    loss_spatial = torch.tensor(0.0).to(device)
-    # N = A.shape[-1]
-    for c in range(1, n_classes):
-        # score = A[:, c] # N -> UPDATED
-        score = A[0, c] # N  <---  علامت : تبدیل شد به 0
-        nearest_score = score[nearest] # N ks^2-1
-        abs_nearest = torch.abs(nearest_score)
-        max_indices = torch.argmax(abs_nearest, dim=1)
-        local_prototype = nearest_score.gather(1, max_indices.view(-1, 1)).squeeze()
-        # print(local_prototype[:10])
-        loss_spatial += torch.mean(torch.abs(torch.tanh(score - local_prototype)))
+def spatial_constraint(A, n_classes, nearest, ks=3, valid=None):
+    """
+    A: 1 x n_classes x N attribute scores; nearest: N x K neighbour indices, missing neighbours given as self-indices.
+    valid: optional N x K mask of the real neighbours (ragged neighbourhoods, see csr_to_neighbours);
+    masked-out entries behave like self-indices. All foreground classes are handled in one batched gather.
+    """
+    score = A[0, 1:n_classes] # C-1 x N
+    nearest_score = score[:, nearest] # C-1 x N x K
+    if valid is not None:
+        nearest_score = torch.where(valid, nearest_score, score.unsqueeze(-1))
+    max_indices = torch.argmax(torch.abs(nearest_score), dim=-1, keepdim=True)
+    local_prototype = nearest_score.gather(-1, max_indices).squeeze(-1) # C-1 x N
+    loss_spatial = torch.sum(torch.mean(torch.abs(torch.tanh(score - local_prototype)), dim=-1))
     return loss_spatial
 
 
-def rank_constraint(data, label, model, A, n_classes, label_positive_list, label_negative_list):
-    loss_rank = torch.tensor(0.0).to(device)
-    for c in range(n_classes):
-        if label == c:
-            value, indice = torch.topk(A[0, c], k=1)
-            h = data[indice.item(): indice.item() + 1] # top feature
-            if label_positive_list[c].full():
-                _ = label_positive_list[c].get()
-            label_positive_list[c].put(h)
-            if label_negative_list[c].empty():
-                loss_rank = loss_rank + torch.tensor(0.0).to(device)
-            else:
-                h = label_negative_list[c].get()
-                label_negative_list[c].put(h)
-                _, _, _, Ah, _ = model(h.detach())
-                if c != 0:
-                    loss_rank = loss_rank + torch.clamp(torch.mean(Ah[0, c] - value), min=0.0) + torch.clamp(torch.mean(-value), min=0.0) + torch.clamp(torch.mean(Ah[0, c]), min=0.0)
-                else:
-                    loss_rank = loss_rank + torch.clamp(torch.mean(-value), min=0.0) + torch.clamp(torch.mean(Ah[0, c]), min=0.0)
-        else:
-            value, indice = torch.topk(A[0, c], k=1)
-            h = data[indice.item(): indice.item() + 1] # top feature
-            if label_negative_list[c].full():
-                _ = label_negative_list[c].get()
-            label_negative_list[c].put(h)
-            if label_positive_list[c].empty():
-                loss_rank = loss_rank + torch.tensor(0.0).to(device)
-            else:
-                h = label_positive_list[c].get()
-                label_positive_list[c].put(h)
-                _, _, _, Ah, _ = model(h.detach())
-                if c != 0:
-                    loss_rank = loss_rank + torch.clamp(torch.mean(value - Ah[0, c]), min=0.0) + torch.clamp(torch.mean(value), min=0.0)
-                else:
-                    loss_rank = loss_rank + torch.clamp(torch.mean(value), min=0.0) + torch.clamp(torch.mean(-Ah[0, c]), min=0.0)
-    loss_rank = loss_rank / n_classes
-    return loss_rank, label_positive_list, label_negative_list
+def csr_to_neighbours(indptr, indices, max_neighbours=None):
+    """
+    Pads a CSR neighbour list (the neighbours of instance i are indices[indptr[i]:indptr[i + 1]]) into
+    the N x K index / validity mask pair taken by spatial_constraint. Padding slots hold self-indices.
+    """
+    counts = indptr[1:] - indptr[:-1]
+    n = counts.numel()
+    k = max(int(counts.max()) if n > 0 else 0, 1) if max_neighbours is None else max_neighbours
+    slot = torch.arange(k, device=indices.device).unsqueeze(0)
+    valid = slot < counts.unsqueeze(1)
+    self_index = torch.arange(n, device=indices.device).unsqueeze(1).expand(n, k)
+    if indices.numel() == 0:
+        return self_index.clone(), valid
+    position = (indptr[:-1].unsqueeze(1) + slot).clamp(max=indices.numel() - 1)
+    nearest = torch.where(valid, indices[position], self_index)
+    return nearest, valid
+
+
+class ExemplarBank(object):
+    """
+    On-device ring buffers of the top-scoring instance features, one per (polarity, class):
+    polarity 0 keeps exemplars from bags labelled with that class, polarity 1 from bags of the other classes.
+    Reads return the oldest exemplar and move it to the back, the same cycling as the former
+    queue.Queue get/put pairs, but for every class at once and without host synchronisation.
+    """
+    def __init__(self, n_classes, size=4):
+        self.n_classes = n_classes
+        self.size = size
+        self.features = None
+
+    def _allocate(self, like):
+        self.features = like.new_zeros(2, self.n_classes, self.size, like.size(-1))
+        self.head = torch.zeros(2, self.n_classes, dtype=torch.long, device=like.device)
+        self.count = torch.zeros(2, self.n_classes, dtype=torch.long, device=like.device)
+        self.classes = torch.arange(self.n_classes, device=like.device)
+
+    def push(self, polarity, features):
+        # polarity: n_classes (0/1) bank per class, features: n_classes x dim; a full buffer drops its oldest
+        if self.features is None:
+            self._allocate(features)
+        head = self.head[polarity, self.classes]
+        count = self.count[polarity, self.classes]
+        self.features[polarity, self.classes, (head + count) % self.size] = features
+        full = count == self.size
+        self.head[polarity, self.classes] = (head + full) % self.size
+        self.count[polarity, self.classes] = count + (~full)
+
+    def rotate(self, polarity):
+        # oldest exemplar of each class's bank (moved to the back) and whether that bank holds any
+        head = self.head[polarity, self.classes]
+        count = self.count[polarity, self.classes]
+        exemplars = self.features[polarity, self.classes, head]
+        self.features[polarity, self.classes, (head + count) % self.size] = exemplars
+        non_empty = count > 0
+        self.head[polarity, self.classes] = (head + non_empty) % self.size
+        return exemplars, non_empty
+
+
+def rank_constraint(data, label, model, A, n_classes, bank):
+    """
+    data: N x dim bag, A: 1 x n_classes x N attribute scores, bank: ExemplarBank.
+    The exemplars of all classes go through the model as one bag: an AttriMIL attribute score only
+    depends on its own instance, so this equals the former per-class single-instance forwards.
+    """
+    value, indice = torch.topk(A[0], k=1, dim=-1) # top instance per class, n_classes x 1
+    value = value[:, 0]
+    classes = torch.arange(n_classes, device=A.device)
+    is_label = classes == label.view(-1)[0]
+    bank.push((~is_label).long(), data[indice[:, 0]].detach())
+    exemplars, available = bank.rotate(is_label.long())
+    _, _, _, Ah, _ = model(exemplars)
+    Ah = torch.diagonal(Ah[0]) # score of class c's branch on class c's exemplar
+    foreground = classes != 0
+    positive = torch.clamp(Ah - value, min=0.0) * foreground + torch.clamp(-value, min=0.0) + torch.clamp(Ah, min=0.0)
+    negative = torch.clamp(value - Ah, min=0.0) * foreground + torch.clamp(value, min=0.0) + torch.clamp(-Ah, min=0.0) * ~foreground
+    loss_rank = torch.sum(torch.where(is_label, positive, negative) * available) / n_classes
+    return loss_rank
@@ -6,12 +6,74 @@ from tqdm import tqdm
 import shutil
 import argparse # اضافه شد
 
+# find_nearest layout in patch_size units of (coords[:, 0], coords[:, 1]):
+# left, right, up, down, left_up, left_down, right_up, right_down
+GRID_OFFSETS = [(0, -1), (0, 1), (-1, 0), (1, 0), (-1, -1), (1, -1), (-1, 1), (1, 1)]
+
+
+def neighbour_offsets(radius=1):
+    """The 8 find_nearest offsets first, then the remaining cells of the (2*radius+1)^2 window ring by ring."""
+    window = [(d0, d1) for d0 in range(-radius, radius + 1) for d1 in range(-radius, radius + 1)]
+    rest = [o for o in window if o != (0, 0) and o not in GRID_OFFSETS]
+    rest.sort(key=lambda o: max(abs(o[0]), abs(o[1])))
+    return (GRID_OFFSETS if radius >= 1 else []) + rest
+
+
+def grid_nearest(coords, patch_size=(256, 256), radius=1, include_self=True):
+    """
+    Neighbour indices of every patch on the patch grid, resolved with one vectorised table lookup
+    instead of scanning coords per patch. Returns an N x (1 + M) int64 array: the patch itself, then
+    the M = (2*radius+1)^2 - 1 offsets of neighbour_offsets(radius); a missing neighbour is replaced
+    by the patch's own index (the find_nearest convention). Duplicated coordinates resolve to the
+    first occurrence.
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    step = np.asarray(patch_size, dtype=np.int64)
+    n = len(coords)
+    self_index = np.arange(n)
+    shifts = np.asarray(neighbour_offsets(radius), dtype=np.int64).reshape(-1, 2)
+    if n == 0:
+        return np.zeros((0, len(shifts) + int(include_self)), dtype=np.int64)
+
+    lo = coords.min(axis=0)
+    cells = (coords - lo) // step
+    extent = cells.max(axis=0) + 2 * radius + 1
+    if np.all((coords - lo) % step == 0) and np.prod(extent) <= 64 * n + (1 << 20):
+        # coordinates on the patch lattice: dense hash table of grid cells, O(N)
+        table = np.full(tuple(extent), -1, dtype=np.int64)
+        cells = cells + radius
+        # unique keys with the index of their first occurrence, so duplicated coordinates resolve like find_nearest
+        keys, first = np.unique(cells[:, 0] * extent[1] + cells[:, 1], return_index=True)
+        table.flat[keys] = first
+        query = cells[:, None, :] + shifts[None]
+        found = table[query[..., 0], query[..., 1]]
+    else:
+        # off-lattice or very sparse coordinates: exact keys, resolved by binary search
+        lo = lo - radius * step
+        span = coords[:, 1].max() - lo[1] + radius * step[1] + 1
+        keys, first = np.unique((coords[:, 0] - lo[0]) * span + (coords[:, 1] - lo[1]), return_index=True)
+        query = coords[:, None, :] + shifts[None] * step
+        query_keys = (query[..., 0] - lo[0]) * span + (query[..., 1] - lo[1])
+        position = np.clip(np.searchsorted(keys, query_keys), 0, len(keys) - 1)
+        found = np.where(keys[position] == query_keys, first[position], -1)
+    nearest = np.where(found >= 0, found, self_index[:, None])
+    if include_self:
+        nearest = np.concatenate([self_index[:, None], nearest], axis=1)
+    return nearest
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="هماهنگ‌سازی دیتا با استاندارد AttriMIL و محاسبه نزدیک‌ترین همسایه‌ها")
     
     parser.add_argument('--save_dir', type=str, 
                         default='/content/AttriMIL_Workspace/data/h5_coords_files',
                         help='مسیر نهایی برای ذخیره فایل‌های پردازش شده')
+    parser.add_argument('--neighbours', type=str, choices=['knn', 'grid'], default='knn',
+                        help='knn: 8 nearest patches (ball tree); grid: patch-grid neighbours from grid_nearest')
+    parser.add_argument('--patch_size', type=int, nargs=2, default=[256, 256],
+                        help='grid step of the coords, used with --neighbours grid')
+    parser.add_argument('--radius', type=int, default=1,
+                        help='grid neighbourhood radius, used with --neighbours grid')
     
     return parser.parse_args()
 
@@ -35,9 +97,12 @@ def main():
                     features = np.array(h5_in['features']).squeeze(0)
                     coords = np.array(h5_in['coords']).squeeze(0)
                 
-                nbrs = NearestNeighbors(n_neighbors=9, algorithm='ball_tree').fit(coords)
-                _, indices = nbrs.kneighbors(coords)
-                nearest = indices[:, 1:]
+                if args.neighbours == 'grid':
+                    nearest = grid_nearest(coords, args.patch_size, args.radius, include_self=False)
+                else:
+                    nbrs = NearestNeighbors(n_neighbors=9, algorithm='ball_tree').fit(coords)
+                    _, indices = nbrs.kneighbors(coords)
+                    nearest = indices[:, 1:]
                 
                 with h5py.File(os.path.join(save_dir, name), 'w') as h5_out:
                     h5_out.create_dataset('features', data=features)
@@ -11,6 +11,9 @@ from scipy import stats
 from torch.utils.data import Dataset
 import h5py
 
+from feature_store import FeatureStore
+from bag_cache import SharedBagCache
+
 def save_splits(split_datasets, column_keys, filename, boolean_style=False):
 	splits = [split_datasets[i].slide_data['slide_id'] for i in range(len(split_datasets))]
 	if not boolean_style:
@@ -55,6 +58,8 @@ class Generic_WSI_Classification_Dataset(Dataset):
 		self.patient_strat = patient_strat
 		self.train_ids, self.val_ids, self.test_ids  = (None, None, None)
 		self.data_dir = None
+		self.store = None
+		self.cache = None
 		if not label_col:
 			label_col = 'label'
 		self.label_col = label_col
@@ -152,7 +157,7 @@ class Generic_WSI_Classification_Dataset(Dataset):
 		if len(split) > 0:
 			mask = self.slide_data['slide_id'].isin(split.tolist())
 			df_slice = self.slide_data[mask].reset_index(drop=True)
-			split = Generic_Split(df_slice, data_dir=self.data_dir, num_classes=self.num_classes)
+			split = Generic_Split(df_slice, data_dir=self.data_dir, num_classes=self.num_classes, store=self.store, cache=self.cache)
 		else:
 			split = None
 		
@@ -168,7 +173,7 @@ class Generic_WSI_Classification_Dataset(Dataset):
 		if len(split) > 0:
 			mask = self.slide_data['slide_id'].isin(merged_split)
 			df_slice = self.slide_data[mask].reset_index(drop=True)
-			split = Generic_Split(df_slice, data_dir=self.data_dir, num_classes=self.num_classes)
+			split = Generic_Split(df_slice, data_dir=self.data_dir, num_classes=self.num_classes, store=self.store, cache=self.cache)
 		else:
 			split = None
 		
@@ -181,21 +186,21 @@ class Generic_WSI_Classification_Dataset(Dataset):
 		if from_id:
 			if len(self.train_ids) > 0:
 				train_data = self.slide_data.loc[self.train_ids].reset_index(drop=True)
-				train_split = Generic_Split(train_data, data_dir=self.data_dir, num_classes=self.num_classes)
+				train_split = Generic_Split(train_data, data_dir=self.data_dir, num_classes=self.num_classes, store=self.store, cache=self.cache)
 
 			else:
 				train_split = None
 			
 			if len(self.val_ids) > 0:
 				val_data = self.slide_data.loc[self.val_ids].reset_index(drop=True)
-				val_split = Generic_Split(val_data, data_dir=self.data_dir, num_classes=self.num_classes)
+				val_split = Generic_Split(val_data, data_dir=self.data_dir, num_classes=self.num_classes, store=self.store, cache=self.cache)
 
 			else:
 				val_split = None
 			
 			if len(self.test_ids) > 0:
 				test_data = self.slide_data.loc[self.test_ids].reset_index(drop=True)
-				test_split = Generic_Split(test_data, data_dir=self.data_dir, num_classes=self.num_classes)
+				test_split = Generic_Split(test_data, data_dir=self.data_dir, num_classes=self.num_classes, store=self.store, cache=self.cache)
 			
 			else:
 				test_split = None
@@ -275,15 +280,52 @@ class Generic_WSI_Classification_Dataset(Dataset):
 class Generic_MIL_Dataset(Generic_WSI_Classification_Dataset):
 	def __init__(self,
 		data_dir, 
+		store_dir = None,
+		cache_bytes = 0,
 		**kwargs):
+		"""
+		Args:
+			data_dir (string or dict): Directory (or {source: directory}) holding h5_coords_files/
+			store_dir (string or dict): Optional packed FeatureStore (or {source: store}) served instead of the per-slide h5 files
+			cache_bytes (int): Budget of the LRU bag cache shared by the DataLoader workers and all splits; 0 disables it
+		"""
 	
 		super(Generic_MIL_Dataset, self).__init__(**kwargs)
 		self.data_dir = data_dir
 		self.use_h5 = True
+		self.load_from_store(store_dir)
+		self.cache = SharedBagCache(cache_bytes) if cache_bytes > 0 else None
 
 	def load_from_h5(self, toggle):
 		self.use_h5 = toggle
 
+	def load_from_store(self, store_dir):
+		if store_dir is None:
+			self.store = None
+		elif type(store_dir) == dict:
+			self.store = {source: FeatureStore(path) for source, path in store_dir.items()}
+		else:
+			self.store = FeatureStore(store_dir)
+
+	def get_bag_sizes(self):
+		# number of instances per bag, read from the store index or the h5 headers (no feature reads)
+		if getattr(self, '_bag_sizes', None) is None:
+			sizes = []
+			for idx in range(len(self.slide_data)):
+				slide_id = self.slide_data['slide_id'][idx]
+				if self.store is not None:
+					store = self.store[self.slide_data['source'][idx]] if type(self.store) == dict else self.store
+					sizes.append(store.bag_size(slide_id))
+				else:
+					data_dir = self.data_dir[self.slide_data['source'][idx]] if type(self.data_dir) == dict else self.data_dir
+					with h5py.File(os.path.join(data_dir, 'h5_coords_files', '{}.h5'.format(slide_id)), 'r') as hdf5_file:
+						sizes.append(hdf5_file['features'].shape[0])
+			self._bag_sizes = np.array(sizes)
+		return self._bag_sizes
+
+	def cache_info(self):
+		return self.cache.info() if self.cache is not None else None
+
 	def __getitem__(self, idx):
 		slide_id = self.slide_data['slide_id'][idx]
 		label = self.slide_data['label'][idx]
@@ -300,21 +342,33 @@ class Generic_MIL_Dataset(Generic_WSI_Classification_Dataset):
 			
 			else:
 				return slide_id, label
+		elif self.store is not None:
+			store = self.store[self.slide_data['source'][idx]] if type(self.store) == dict else self.store
+			features, coords, nearest = store.get(slide_id)
+			return features, label, coords, nearest
 		else:
 			full_path = os.path.join(data_dir,'h5_coords_files','{}.h5'.format(slide_id))
-			with h5py.File(full_path,'r') as hdf5_file:
-				features = hdf5_file['features'][:]
-				coords = hdf5_file['coords'][:]
-				nearest = hdf5_file['nearest'][:]
+			bag = self.cache.get(full_path) if self.cache is not None else None
+			if bag is None:
+				with h5py.File(full_path,'r') as hdf5_file:
+					features = hdf5_file['features'][:]
+					coords = hdf5_file['coords'][:]
+					nearest = hdf5_file['nearest'][:]
+				if self.cache is not None:
+					self.cache.put(full_path, (features, coords, nearest))
+			else:
+				features, coords, nearest = bag
 			features = torch.from_numpy(features)
 			return features, label, coords, nearest
 
 
 class Generic_Split(Generic_MIL_Dataset):
-	def __init__(self, slide_data, data_dir=None, num_classes=2):
+	def __init__(self, slide_data, data_dir=None, num_classes=2, store=None, cache=None):
 		self.use_h5 = True
 		self.slide_data = slide_data
 		self.data_dir = data_dir
+		self.store = store
+		self.cache = cache
 		self.num_classes = num_classes
 		self.slide_cls_ids = [[] for i in range(self.num_classes)]
 		for i in range(self.num_classes):
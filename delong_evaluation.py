@@ -0,0 +1,97 @@
+import os
+import argparse
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from scipy.stats import norm, rankdata
+
+
+def fast_delong(y_true, scores):
+    """
+    AUCs and their DeLong covariance for K score vectors of the same samples, with the O(K n log n) midrank
+    algorithm of Sun & Xu (2014). ``scores`` is K x N; returns (aucs [K], covariance [K x K]).
+    """
+    y_true = np.asarray(y_true) == 1
+    scores = np.atleast_2d(np.asarray(scores, dtype=np.float64))
+    positive, negative = scores[:, y_true], scores[:, ~y_true]
+    m, n = positive.shape[1], negative.shape[1]
+    if m < 2 or n < 2:
+        raise ValueError("DeLong needs at least two positive and two negative samples, got {} and {}".format(m, n))
+
+    tx = rankdata(positive, axis=1)
+    ty = rankdata(negative, axis=1)
+    tz = rankdata(np.concatenate([positive, negative], axis=1), axis=1)
+    aucs = tz[:, :m].sum(axis=1) / m / n - (m + 1.0) / 2.0 / n
+    v01 = (tz[:, :m] - tx) / n
+    v10 = 1.0 - (tz[:, m:] - ty) / m
+    covariance = np.atleast_2d(np.cov(v01)) / m + np.atleast_2d(np.cov(v10)) / n
+    return aucs, covariance
+
+
+def delong_ci(y_true, y_score, ci=0.95):
+    """AUC, its DeLong standard error and the normal CI, clipped to [0, 1]."""
+    aucs, covariance = fast_delong(y_true, y_score)
+    se = np.sqrt(covariance[0, 0])
+    z = norm.ppf(0.5 + ci / 2)
+    return aucs[0], se, max(aucs[0] - z * se, 0.), min(aucs[0] + z * se, 1.)
+
+
+def delong_test(y_true, score_a, score_b):
+    """Two-sided paired DeLong test of AUC(score_a) == AUC(score_b); returns (auc_a, auc_b, z, p)."""
+    aucs, covariance = fast_delong(y_true, np.stack([score_a, score_b]))
+    var = covariance[0, 0] + covariance[1, 1] - 2 * covariance[0, 1]
+    if var <= 0:  # identical rankings
+        return aucs[0], aucs[1], 0., 1.
+    z = (aucs[0] - aucs[1]) / np.sqrt(var)
+    return aucs[0], aucs[1], z, 2 * norm.sf(abs(z))
+
+
+def compare_models(fold_csvs, ci=0.95, score_col='p_1'):
+    """
+    ``fold_csvs``: model name -> list of fold_k.csv paths (same fold order for every model).
+    Returns the per-model/per-fold AUC CIs and the paired p-values of every model pair in every fold,
+    the pairs being evaluated on the slides both models scored (merged on slide_id).
+    """
+    folds = {name: [pd.read_csv(path, dtype={'slide_id': str}) for path in paths] for name, paths in fold_csvs.items()}
+    auc_rows, pair_rows = [], []
+    for name, dfs in folds.items():
+        for fold, df in enumerate(dfs):
+            auc, se, low, high = delong_ci(df['Y'].values, df[score_col].values, ci)
+            auc_rows.append({'model': name, 'fold': fold, 'n': len(df), 'auc': auc, 'se': se,
+                             'ci_low': low, 'ci_high': high})
+
+    for name_a, name_b in combinations(folds, 2):
+        for fold, (df_a, df_b) in enumerate(zip(folds[name_a], folds[name_b])):
+            merged = df_a[['slide_id', 'Y', score_col]].merge(df_b[['slide_id', 'Y', score_col]],
+                                                              on='slide_id', suffixes=('_a', '_b'))
+            if not np.array_equal(merged['Y_a'].values, merged['Y_b'].values):
+                raise ValueError("{} and {} disagree on the labels of fold {}".format(name_a, name_b, fold))
+            auc_a, auc_b, z, p = delong_test(merged['Y_a'].values, merged[score_col + '_a'].values,
+                                             merged[score_col + '_b'].values)
+            pair_rows.append({'model_a': name_a, 'model_b': name_b, 'fold': fold, 'n': len(merged),
+                              'auc_a': auc_a, 'auc_b': auc_b, 'z': z, 'p_value': p})
+    return pd.DataFrame(auc_rows), pd.DataFrame(pair_rows)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="DeLong AUC confidence intervals and paired model comparisons")
+    parser.add_argument('--model', action='append', nargs='+', required=True, metavar=('NAME', 'FOLD_CSV'),
+                        help='model name followed by its fold_k.csv files; repeat for every model')
+    parser.add_argument('--ci', type=float, default=0.95, help='confidence level')
+    parser.add_argument('--save_dir', type=str, default=None,
+                        help='write delong_auc.csv and delong_pairs.csv here')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    fold_csvs = {model[0]: model[1:] for model in args.model}
+    auc_df, pair_df = compare_models(fold_csvs, args.ci)
+    pd.set_option('display.width', 200)
+    print(auc_df.to_string(index=False, float_format='{:.4f}'.format))
+    if len(pair_df):
+        print(pair_df.to_string(index=False, float_format='{:.4g}'.format))
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+        auc_df.to_csv(os.path.join(args.save_dir, 'delong_auc.csv'), index=False)
+        pair_df.to_csv(os.path.join(args.save_dir, 'delong_pairs.csv'), index=False)
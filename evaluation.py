@@ -0,0 +1,129 @@
+import os
+import copy
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn.functional as F
+
+from sklearn.preprocessing import label_binarize
+from sklearn.metrics import roc_auc_score, roc_curve
+from sklearn.metrics import auc as calc_auc
+
+
+class Accuracy_Logger(object):
+    """Accuracy logger"""
+    def __init__(self, n_classes):
+        super().__init__()
+        self.n_classes = n_classes
+        self.initialize()
+
+    def initialize(self):
+        self.data = [{"count": 0, "correct": 0} for i in range(self.n_classes)]
+
+    def log_batch(self, Y_hat, Y):
+        Y_hat = np.array(Y_hat).astype(int)
+        Y = np.array(Y).astype(int)
+        for label_class in np.unique(Y):
+            cls_mask = Y == label_class
+            self.data[label_class]["count"] += cls_mask.sum()
+            self.data[label_class]["correct"] += (Y_hat[cls_mask] == Y[cls_mask]).sum()
+
+    def get_summary(self, c):
+        count = self.data[c]["count"]
+        correct = self.data[c]["correct"]
+        if count == 0:
+            acc = None
+        else:
+            acc = float(correct) / count
+        return acc, correct, count
+
+
+def predict_default(model, data):
+    """(Y_prob, Y_hat) of the models returning (logits, Y_prob, Y_hat, ...): AttriMIL, ABMIL, MIL_*, TransMIL."""
+    _, Y_prob, Y_hat = model(data)[:3]
+    return Y_prob, Y_hat
+
+
+def predict_dsmil(model, data):
+    ins_prediction, bag_prediction, _, _ = model(data)
+    Y_hat = torch.topk(bag_prediction.view(1, -1), 1, dim = 1)[1]
+    return F.softmax(bag_prediction, dim=-1), Y_hat
+
+
+def load_fold_models(model, ckpt_paths):
+    """One eval-mode copy of ``model`` per checkpoint, on the device of ``model``."""
+    device = next(model.parameters()).device
+    models = []
+    for ckpt_path in ckpt_paths:
+        fold_model = copy.deepcopy(model)
+        fold_model.load_state_dict(torch.load(ckpt_path, map_location=device))
+        models.append(fold_model.eval())
+    return models
+
+
+def fold_summary(slide_ids, labels, probs, preds, n_classes):
+    """The (patient_results, test_error, auc_score, df, acc_logger) tuple of the testers' summary() from stored predictions."""
+    acc_logger = Accuracy_Logger(n_classes=n_classes)
+    acc_logger.log_batch(preds, labels)
+    test_error = float(np.mean(preds != labels)) if len(labels) else 0.
+
+    patient_results = {}
+    for slide_id, prob, label in zip(slide_ids, probs, labels):
+        patient_results.update({slide_id: {'slide_id': np.array(slide_id), 'prob': prob[None], 'label': label}})
+
+    if len(np.unique(labels)) == 1:
+        auc_score = -1
+    else:
+        if n_classes == 2:
+            auc_score = roc_auc_score(labels, probs[:, 1])
+        else:
+            binary_labels = label_binarize(labels, classes=[i for i in range(n_classes)])
+            fpr, tpr, _ = roc_curve(binary_labels.ravel(), probs.ravel())
+            auc_score = calc_auc(fpr, tpr)
+
+    results_dict = {'slide_id': slide_ids, 'Y': labels, 'Y_hat': preds}
+    for c in range(n_classes):
+        results_dict.update({'p_{}'.format(c): probs[:, c]})
+    df = pd.DataFrame(results_dict)
+    return patient_results, test_error, auc_score, df, acc_logger
+
+
+def evaluate_folds(models, loader, n_classes, predict=predict_default, ensemble=False):
+    """
+    Evaluate every fold model in one pass over ``loader``: each bag is read and moved to the device once and
+    fed to all models. With ``ensemble`` an extra result averaging the fold probabilities is appended.
+    Returns one fold_summary() tuple per model (plus the ensemble).
+    """
+    device = next(models[0].parameters()).device
+    n_models = len(models)
+    all_probs = np.zeros((n_models + int(ensemble), len(loader), n_classes))
+    all_preds = np.zeros((n_models + int(ensemble), len(loader)))
+    all_labels = np.zeros(len(loader))
+
+    slide_ids = loader.dataset.slide_data['slide_id']
+    for batch_idx, (data, label) in enumerate(loader):
+        data = data.to(device, non_blocking=True)
+        all_labels[batch_idx] = label.item()
+        with torch.inference_mode():
+            for k, model in enumerate(models):
+                Y_prob, Y_hat = predict(model, data)
+                all_probs[k, batch_idx] = Y_prob.cpu().numpy().reshape(-1)
+                all_preds[k, batch_idx] = Y_hat.item()
+        del data
+
+    if ensemble:
+        all_probs[-1] = all_probs[:n_models].mean(axis=0)
+        all_preds[-1] = all_probs[-1].argmax(axis=1)
+    return [fold_summary(slide_ids, all_labels, probs, preds, n_classes) for probs, preds in zip(all_probs, all_preds)]
+
+
+def save_results(results, folds, save_dir):
+    """Write fold_<k>.csv per result and summary.csv, as the per-checkpoint tester loop did."""
+    all_auc, all_acc = [], []
+    for fold, (_, test_error, auc, df, _) in zip(folds, results):
+        all_auc.append(auc)
+        all_acc.append(1 - test_error)
+        df.to_csv(os.path.join(save_dir, 'fold_{}.csv'.format(fold)), index=False)
+    final_df = pd.DataFrame({'folds': folds, 'test_auc': all_auc, 'test_acc': all_acc})
+    final_df.to_csv(os.path.join(save_dir, 'summary.csv'))
+    return final_df
@@ -0,0 +1,107 @@
+import os
+import argparse
+import h5py
+import numpy as np
+import pandas as pd
+import torch
+from tqdm import tqdm
+
+ARRAYS = ['features', 'coords', 'nearest']
+
+
+class FeatureStore(object):
+    """Packed, memory-mapped cohort store.
+
+    One contiguous ``<name>.npy`` per array in ``ARRAYS`` plus ``index.csv``
+    holding the (offset, length) row range of every slide. The memmaps are
+    opened lazily so the store can be pickled into DataLoader workers without
+    copying the data.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        index = pd.read_csv(os.path.join(store_dir, 'index.csv'), dtype={'slide_id': str})
+        self.index = {slide_id: (offset, length) for slide_id, offset, length in
+                      zip(index['slide_id'], index['offset'], index['length'])}
+        self._arrays = None
+
+    def _open(self):
+        # copy-on-write keeps the views writable (torch.from_numpy requires it) without touching the file
+        self._arrays = {name: np.load(os.path.join(self.store_dir, '{}.npy'.format(name)), mmap_mode='c')
+                        for name in ARRAYS}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    def __contains__(self, slide_id):
+        return str(slide_id) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def bag_size(self, slide_id):
+        return self.index[str(slide_id)][1]
+
+    def get(self, slide_id):
+        if self._arrays is None:
+            self._open()
+        offset, length = self.index[str(slide_id)]
+        features = torch.from_numpy(self._arrays['features'][offset: offset + length])
+        coords = self._arrays['coords'][offset: offset + length]
+        nearest = self._arrays['nearest'][offset: offset + length]
+        return features, coords, nearest
+
+
+def build_feature_store(h5_dir, store_dir, slide_ids=None):
+    """Pack every ``<slide_id>.h5`` of ``h5_dir`` into a FeatureStore at ``store_dir``."""
+    if slide_ids is None:
+        slide_ids = sorted(f[:-3] for f in os.listdir(h5_dir) if f.endswith('.h5'))
+    os.makedirs(store_dir, exist_ok=True)
+
+    # first pass: shapes only, so the output files can be allocated up front
+    lengths = []
+    shapes, dtypes = {}, {}
+    for slide_id in slide_ids:
+        with h5py.File(os.path.join(h5_dir, '{}.h5'.format(slide_id)), 'r') as f:
+            lengths.append(f['features'].shape[0])
+            for name in ARRAYS:
+                shape = f[name].shape[1:]
+                if shapes.setdefault(name, shape) != shape:
+                    raise ValueError("{}: '{}' has shape {} but the store uses {}".format(slide_id, name, shape, shapes[name]))
+                dtypes.setdefault(name, f[name].dtype)
+                if f[name].shape[0] != lengths[-1]:
+                    raise ValueError("{}: '{}' has {} rows, expected {}".format(slide_id, name, f[name].shape[0], lengths[-1]))
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    total = int(offsets[-1])
+
+    arrays = {name: np.lib.format.open_memmap(os.path.join(store_dir, '{}.npy'.format(name)), mode='w+',
+                                              dtype=dtypes[name], shape=(total,) + shapes[name])
+              for name in ARRAYS}
+    for i, slide_id in enumerate(tqdm(slide_ids)):
+        with h5py.File(os.path.join(h5_dir, '{}.h5'.format(slide_id)), 'r') as f:
+            for name in ARRAYS:
+                f[name].read_direct(arrays[name], dest_sel=np.s_[offsets[i]: offsets[i + 1]])
+    for array in arrays.values():
+        array.flush()
+
+    pd.DataFrame({'slide_id': slide_ids, 'offset': offsets[:-1], 'length': lengths}).to_csv(
+        os.path.join(store_dir, 'index.csv'), index=False)
+    return FeatureStore(store_dir)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pack per-slide h5 files into a memory-mapped feature store")
+    parser.add_argument('--h5_dir', type=str,
+                        default='/content/AttriMIL_Workspace/data/h5_coords_files',
+                        help='directory of <slide_id>.h5 files with features/coords/nearest')
+    parser.add_argument('--store_dir', type=str,
+                        default='/content/AttriMIL_Workspace/data/feature_store',
+                        help='output directory of the packed store')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = build_feature_store(args.h5_dir, args.store_dir)
+    print("Packed {} slides into {}".format(len(store), args.store_dir))
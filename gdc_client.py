@@ -0,0 +1,208 @@
+import os
+import csv
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+
+GDC_API = "https://api.gdc.cancer.gov"
+MANIFEST_FIELDS = ['file_id', 'path', 'md5sum', 'size', 'status']
+
+
+def md5_file(path, block_size=1 << 20):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class GDCClient(object):
+    """
+    GDC API client shared by the download scripts: one pooled ``requests.Session`` with retries, paginated
+    queries, resumable (HTTP Range) downloads verified against md5 sums, and a bounded thread pool for many
+    files. ``base_url`` is pluggable so the client can be pointed at a StubGDCServer.
+    """
+    def __init__(self, base_url=GDC_API, workers=8, retries=3, timeout=60, session=None):
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def query(self, endpoint, filters, fields, page_size=1000, max_hits=None):
+        """All hits of a GDC search endpoint (e.g. 'files'), following the pagination instead of stopping at one page."""
+        hits = []
+        while max_hits is None or len(hits) < max_hits:
+            size = page_size if max_hits is None else min(page_size, max_hits - len(hits))
+            payload = {"filters": filters, "fields": fields if isinstance(fields, str) else ",".join(fields),
+                       "format": "JSON", "size": str(size), "from": str(len(hits))}
+            response = self.session.post("{}/{}".format(self.base_url, endpoint), json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()["data"]
+            hits.extend(data["hits"])
+            total = data.get("pagination", {}).get("total", len(hits))
+            if not data["hits"] or len(hits) >= total:
+                break
+        return hits
+
+    def download(self, file_id, save_path, md5sum=None, chunk_size=1 << 16):
+        """
+        Stream ``/data/<file_id>`` to ``save_path``. Bytes land in ``save_path + '.part'`` first, so an interrupted
+        download resumes with a Range request; the file is verified against ``md5sum`` before it is moved in place.
+        """
+        if os.path.exists(save_path) and (md5sum is None or md5_file(save_path) == md5sum):
+            return save_path
+        part_path = save_path + '.part'
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        with self.session.get("{}/data/{}".format(self.base_url, file_id), headers=headers, stream=True,
+                              timeout=self.timeout) as response:
+            if response.status_code != 416:  # 416: the part file already holds every byte
+                response.raise_for_status()
+                mode = 'ab' if response.status_code == 206 else 'wb'  # 200: the server ignored the range
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+        if md5sum is not None and md5_file(part_path) != md5sum:
+            os.remove(part_path)
+            raise IOError("md5 mismatch for {}".format(file_id))
+        os.replace(part_path, save_path)
+        return save_path
+
+    def download_many(self, jobs, manifest_path=None, desc="Downloading"):
+        """
+        Download ``jobs`` = [(file_id, save_path, md5sum or None)] over the thread pool.
+        Each outcome is appended to the ``manifest_path`` CSV; returns {file_id: save_path or None}.
+        """
+        lock = threading.Lock()
+        manifest = None
+        if manifest_path:
+            new = not os.path.exists(manifest_path)
+            manifest = open(manifest_path, 'a', newline='')
+            writer = csv.DictWriter(manifest, fieldnames=MANIFEST_FIELDS)
+            if new:
+                writer.writeheader()
+
+        def fetch(job):
+            file_id, save_path, md5sum = job
+            try:
+                path, status = self.download(file_id, save_path, md5sum), 'done'
+            except (requests.RequestException, IOError) as e:
+                path, status = None, 'failed: {}'.format(e)
+            if manifest is not None:
+                with lock:
+                    writer.writerow({'file_id': file_id, 'path': save_path, 'md5sum': md5sum or '',
+                                     'size': os.path.getsize(path) if path else 0, 'status': status})
+                    manifest.flush()
+            return file_id, path
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                return dict(tqdm(pool.map(fetch, jobs), total=len(jobs), desc=desc))
+        finally:
+            if manifest is not None:
+                manifest.close()
+
+
+def _field_values(hit, field):
+    values = [hit]
+    for key in field.split('.'):
+        nested = []
+        for value in values:
+            value = value.get(key) if isinstance(value, dict) else None
+            nested.extend(value if isinstance(value, list) else [value])
+        values = nested
+    return values
+
+
+def _matches(hit, filters):
+    if not filters:
+        return True
+    op, content = filters["op"], filters["content"]
+    if op == "and":
+        return all(_matches(hit, f) for f in content)
+    if op == "or":
+        return any(_matches(hit, f) for f in content)
+    wanted = content["value"] if isinstance(content["value"], list) else [content["value"]]
+    return any(value in wanted for value in _field_values(hit, content["field"]))
+
+
+class StubGDCServer(object):
+    """
+    Local stand-in for the GDC API, for tests: search endpoints answer from ``hits`` (with "=", "in", "and"
+    and "or" filters and from/size pagination) and ``/data/<file_id>`` serves ``files[file_id]`` bytes
+    with Range support. Use as a context manager and point a GDCClient at ``base_url``.
+    """
+    def __init__(self, hits, files, host='127.0.0.1', port=0):
+        self.hits, self.files, self.requests = hits, files, []
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.base_url = "http://{}:{}".format(*self.server.server_address)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, headers=()):
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _search(self, params):
+                filters = params.get("filters") or {}
+                if isinstance(filters, str):
+                    filters = json.loads(filters)
+                start, size = int(params.get("from", 0)), int(params.get("size", 10))
+                hits = [hit for hit in stub.hits if _matches(hit, filters)]
+                body = {"data": {"hits": hits[start: start + size],
+                                 "pagination": {"from": start, "size": size, "total": len(hits)}}}
+                self._send(200, json.dumps(body).encode(), [('Content-Type', 'application/json')])
+
+            def do_POST(self):
+                stub.requests.append(('POST', self.path, dict(self.headers)))
+                length = int(self.headers.get('Content-Length', 0))
+                self._search(json.loads(self.rfile.read(length) or b'{}'))
+
+            def do_GET(self):
+                stub.requests.append(('GET', self.path, dict(self.headers)))
+                url = urlparse(self.path)
+                if not url.path.startswith('/data/'):
+                    return self._search({key: values[0] for key, values in parse_qs(url.query).items()})
+                data = stub.files.get(url.path[len('/data/'):])
+                if data is None:
+                    return self._send(404, b'not found')
+                requested = self.headers.get('Range')
+                if requested:
+                    start = int(requested.split('=')[1].split('-')[0])
+                    if start >= len(data):
+                        return self._send(416, b'')
+                    return self._send(206, data[start:], [('Content-Range', 'bytes {}-{}/{}'.format(
+                        start, len(data) - 1, len(data)))])
+                self._send(200, data)
+
+        return Handler
@@ -0,0 +1,164 @@
+import os
+import math
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from matplotlib import colormaps
+from attribute_store import AttributeStore
+
+try:
+    import openslide
+except ImportError:  # heatmaps are still rasterised from stored scores, over a blank background
+    openslide = None
+
+DZI_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{fmt}" Overlap="0" TileSize="{tile}">\n'
+                '  <Size Width="{width}" Height="{height}"/>\n'
+                '</Image>\n')
+
+
+def rasterise_scores(scores, coords, shape, downsample=32, patch_size=512):
+    """
+    Mean score of the patches covering every cell of a ``shape`` (rows, cols) grid of ``downsample`` level-0 pixels.
+
+    Each patch adds its score to the box of cells it covers through the four corners of a difference array
+    (one bincount), and two cumulative sums turn the corners back into boxes, so the cost does not grow with the
+    patch area. Cells no patch covers are NaN.
+    """
+    rows, cols = shape
+    coords = np.asarray(coords, dtype=np.int64)
+    x0 = np.clip(coords[:, 0] // downsample, 0, cols)
+    y0 = np.clip(coords[:, 1] // downsample, 0, rows)
+    x1 = np.clip(-(-(coords[:, 0] + patch_size) // downsample), 0, cols)
+    y1 = np.clip(-(-(coords[:, 1] + patch_size) // downsample), 0, rows)
+
+    width = cols + 1
+    corners = np.concatenate([y0 * width + x0, y0 * width + x1, y1 * width + x0, y1 * width + x1])
+    signs = np.concatenate([np.ones_like(x0), -np.ones_like(x0), -np.ones_like(x0), np.ones_like(x0)])
+    size = (rows + 1) * width
+    total = np.bincount(corners, weights=signs * np.tile(np.asarray(scores, dtype=np.float64), 4), minlength=size)
+    count = np.bincount(corners, weights=signs, minlength=size)
+    total = total.reshape(rows + 1, width).cumsum(0).cumsum(1)[:rows, :cols]
+    count = np.rint(count.reshape(rows + 1, width).cumsum(0).cumsum(1)[:rows, :cols])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+
+def colourise(grid, cmap='jet', vmin=None, vmax=None):
+    """RGBA uint8 image of a score grid, min-max scaled; NaN cells are transparent."""
+    valid = ~np.isnan(grid)
+    if not valid.any():
+        return np.zeros(grid.shape + (4,), dtype=np.uint8)
+    vmin = np.nanmin(grid) if vmin is None else vmin
+    vmax = np.nanmax(grid) if vmax is None else vmax
+    scaled = np.where(valid, (grid - vmin) / (vmax - vmin if vmax > vmin else 1.), 0.)
+    rgba = colormaps[cmap](np.clip(scaled, 0., 1.), bytes=True)
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def blend(background, overlay, alpha=0.5):
+    """Alpha-blend an RGBA overlay onto an RGB background of the same size (uint8 arrays)."""
+    weight = overlay[..., 3:4].astype(np.float32) / 255. * alpha
+    mixed = background.astype(np.float32) * (1. - weight) + overlay[..., :3].astype(np.float32) * weight
+    return np.rint(mixed).astype(np.uint8)
+
+
+def slide_thumbnail(wsi_path, downsample=32):
+    """RGB thumbnail of a WSI at ``downsample`` (one pixel per grid cell), or None without the slide or OpenSlide."""
+    if openslide is None or not wsi_path or not os.path.exists(wsi_path):
+        return None
+    wsi = openslide.OpenSlide(wsi_path)
+    try:
+        width, height = wsi.dimensions
+        size = (math.ceil(width / downsample), math.ceil(height / downsample))
+        return np.asarray(wsi.get_thumbnail(size).convert('RGB').resize(size, Image.BILINEAR))
+    finally:
+        wsi.close()
+
+
+def deepzoom_levels(width, height):
+    """(width, height) of every DeepZoom level, from 1 x 1 up to full size."""
+    max_level = int(math.ceil(math.log2(max(width, height, 1))))
+    return [(int(math.ceil(width / 2 ** (max_level - level))), int(math.ceil(height / 2 ** (max_level - level))))
+            for level in range(max_level + 1)]
+
+
+def write_deepzoom(image, output_path, tile_size=256, fmt='png'):
+    """
+    Write an RGB image as a DeepZoom pyramid: ``<name>.dzi`` plus ``<name>_files/<level>/<col>_<row>.<fmt>``,
+    readable by OpenSeadragon. Each level is resized from the one above it.
+    """
+    base = os.path.splitext(output_path)[0]
+    image = Image.fromarray(image)
+    levels = deepzoom_levels(*image.size)
+    with open(base + '.dzi', 'w') as f:
+        f.write(DZI_TEMPLATE.format(fmt=fmt, tile=tile_size, width=image.size[0], height=image.size[1]))
+    for level in range(len(levels) - 1, -1, -1):
+        if image.size != levels[level]:
+            image = image.resize(levels[level], Image.BILINEAR)
+        level_dir = os.path.join(base + '_files', str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        for col in range(0, image.size[0], tile_size):
+            for row in range(0, image.size[1], tile_size):
+                tile = image.crop((col, row, min(col + tile_size, image.size[0]), min(row + tile_size, image.size[1])))
+                tile.save(os.path.join(level_dir, '{}_{}.{}'.format(col // tile_size, row // tile_size, fmt)))
+    return base + '.dzi'
+
+
+def render_heatmap(scores, coords, output_path, wsi_path=None, downsample=32, patch_size=512, alpha=0.5,
+                   cmap='jet', tile_size=None):
+    """
+    Heatmap of one class branch's per-patch ``scores`` at ``coords``, blended over the slide thumbnail (or a white
+    background when the WSI or OpenSlide is missing). Saved as a PNG, plus a DeepZoom pyramid with ``tile_size``.
+    """
+    thumbnail = slide_thumbnail(wsi_path, downsample)
+    if thumbnail is not None:
+        shape = thumbnail.shape[:2]
+    else:
+        extent = coords.max(axis=0) + patch_size if len(coords) else np.ones(2)
+        shape = (int(math.ceil(extent[1] / downsample)), int(math.ceil(extent[0] / downsample)))
+        thumbnail = np.full(shape + (3,), 255, dtype=np.uint8)
+
+    grid = rasterise_scores(scores, coords, shape, downsample, patch_size)
+    image = blend(thumbnail, colourise(grid, cmap), alpha)
+    Image.fromarray(image).save(output_path)
+    if tile_size:
+        write_deepzoom(image, output_path, tile_size)
+    return output_path
+
+
+def render_cohort(store_path, class_name, output_dir, wsi_dir=None, workers=4, ckpt=None, **kwargs):
+    """Heatmaps of one class branch for every slide of an AttributeStore, rendered by a thread pool; returns {slide_id: png path}."""
+    os.makedirs(output_dir, exist_ok=True)
+    with AttributeStore(store_path) as store:
+        class_idx = store.class_names(ckpt).index(class_name)
+
+        def render(slide_id):
+            scores, coords = store.get(slide_id, ckpt)  # h5py serialises the reads, rendering runs in parallel
+            wsi_path = os.path.join(wsi_dir, slide_id + '.svs') if wsi_dir else None
+            output_path = os.path.join(output_dir, '{}_{}_heatmap.png'.format(slide_id, class_name))
+            return slide_id, render_heatmap(scores[class_idx], coords, output_path, wsi_path, **kwargs)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(pool.map(render, store.slides(ckpt)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Attribute heatmaps from a score store (precompute_patches.py score_store=)')
+    parser.add_argument('--store', type=str, required=True, help='AttributeStore HDF5 file')
+    parser.add_argument('--class_name', type=str, default='LUAD')
+    parser.add_argument('--output_dir', type=str, default='./evaluation_results/visualizations/heatmaps')
+    parser.add_argument('--wsi_dir', type=str, default=None, help='slides for the thumbnails; blank background without')
+    parser.add_argument('--downsample', type=int, default=32, help='level-0 pixels per heatmap pixel')
+    parser.add_argument('--patch_size', type=int, default=512, help='level-0 size of a patch')
+    parser.add_argument('--alpha', type=float, default=0.5)
+    parser.add_argument('--tile_size', type=int, default=None, help='also write a DeepZoom pyramid of these tiles')
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    saved = render_cohort(args.store, args.class_name, args.output_dir, args.wsi_dir, args.workers,
+                          downsample=args.downsample, patch_size=args.patch_size, alpha=args.alpha,
+                          tile_size=args.tile_size)
+    print("Rendered {} heatmaps to {}".format(len(saved), args.output_dir))
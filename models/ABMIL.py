@@ -40,15 +40,20 @@ class ABMIL(nn.Module):
         self.classifier = nn.Linear(dim, n_classes)
         self.n_classes = n_classes
     
-    def forward(self, h):
+    def forward(self, h, mask=None):
+        # h: N x dim bag, or B x N x dim zero-padded bags with a B x N boolean mask of the real instances
+        batched = h.dim() == 3
+        if not batched:
+            h = h.unsqueeze(0)
         h = h + self.adaptor(h)
-        logits = torch.empty(1, self.n_classes).float().to(h.device)
         A, h = self.attention_net(h)
-        A = torch.transpose(A, 1, 0) # 1 x N
-        A_raw = A
-        A = F.softmax(A, dim=1)  # softmax over N
+        A = torch.transpose(A, 2, 1) # B x 1 x N
+        A_raw = A if batched else A[0]
+        if mask is not None:
+            A = A.masked_fill(~mask.unsqueeze(1), float('-inf'))
+        A = F.softmax(A, dim=-1)  # softmax over N
 
-        M = torch.mm(A, h) # 1 x dim
+        M = torch.bmm(A, h)[:, 0] # B x dim
         logits = self.classifier(M)
         Y_hat = torch.topk(logits, 1, dim = 1)[1]
         Y_prob = F.softmax(logits, dim = 1)
@@ -72,19 +77,31 @@ class ABMIL_MB(nn.Module):
         self.classifiers = nn.ModuleList(classifer)
         self.n_classes = n_classes
     
-    def forward(self, h):
+    def forward(self, h, mask=None):
+        # h: N x dim bag, or B x N x dim zero-padded bags with a B x N boolean mask of the real instances
+        batched = h.dim() == 3
+        if not batched:
+            h = h.unsqueeze(0)
         h = h + self.adaptor(h)
-        logits = torch.empty(1, self.n_classes).float().to(h.device)
-        A_raw = torch.empty(self.n_classes, h.size(0), ) # N x 1
-        for c in range(self.n_classes):
-            A, h = self.attention_nets[c](h)
-            A = torch.transpose(A, 1, 0)  # 1 x N
-            A = F.softmax(A, dim=1)  # softmax over N
-            A_raw[c] = A
-            M = torch.mm(A, h)
-            logits[0, c] = self.classifiers[c](M)
+        # all branches as grouped matmuls over weights stacked from the ModuleLists (state_dict layout unchanged)
+        nets = self.attention_nets
+        W_ab = torch.cat([net.attention_a[0].weight for net in nets] + [net.attention_b[0].weight for net in nets]) # 2CD x dim
+        b_ab = torch.cat([net.attention_a[0].bias for net in nets] + [net.attention_b[0].bias for net in nets])
+        W_c = torch.cat([net.attention_c.weight for net in nets]) # C x D
+        b_c = torch.cat([net.attention_c.bias for net in nets])
+        a, b = F.linear(h, W_ab, b_ab).chunk(2, dim=-1)
+        gated = (nets[0].attention_a[1:](a) * nets[0].attention_b[1:](b)).unflatten(-1, W_c.shape) # B x N x C x D
+        A = torch.einsum('bncd,cd->bcn', gated, W_c) + b_c.unsqueeze(-1) # B x C x N
+        if mask is not None:
+            A = A.masked_fill(~mask.unsqueeze(1), float('-inf'))
+        A = F.softmax(A, dim=-1)  # softmax over N
+        A_raw = A if batched else A[0]
+        M = torch.bmm(A, h) # B x C x dim, one bag representation per branch
+        W_cls = torch.cat([cls.weight for cls in self.classifiers]) # C x dim
+        b_cls = torch.cat([cls.bias for cls in self.classifiers])
+        logits = torch.sum(M * W_cls, dim=-1) + b_cls # B x C
         Y_hat = torch.topk(logits, 1, dim = 1)[1]
         Y_prob = F.softmax(logits, dim = 1)
         results_dict = {}
-        results_dict.update({'features': M})
+        results_dict.update({'features': M[:, -1]})
         return logits, Y_prob, Y_hat, A_raw, results_dict
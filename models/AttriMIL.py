@@ -56,29 +56,84 @@ class AttriMIL(nn.Module):
         self.n_classes = n_classes
         self.bias = nn.Parameter(torch.zeros(n_classes), requires_grad=True)
     
-    def forward(self, h):
+    def fused_weights(self):
+        # the per-class branch weights stacked for grouped matmuls; built from the ModuleLists on every call,
+        # so checkpoints keep the attention_nets.{c} / classifiers.{c} layout and gradients reach every branch
+        nets = self.attention_nets
+        W_in = torch.cat([net.attention_a[0].weight for net in nets] +
+                         [net.attention_b[0].weight for net in nets] +
+                         [cls.weight for cls in self.classifiers]) # (2CD + C) x dim
+        b_in = torch.cat([net.attention_a[0].bias for net in nets] +
+                         [net.attention_b[0].bias for net in nets] +
+                         [cls.bias for cls in self.classifiers])
+        W_c = torch.cat([net.attention_c.weight for net in nets]) # C x D
+        b_c = torch.cat([net.attention_c.bias for net in nets]) # C
+        return W_in, b_in, W_c, b_c
+
+    def branch_scores(self, h):
+        # h: ... x N x 1536 -> attention logits A_raw and instance scores, both ... x C x N
         # ---------------------------------------------------------
         # تبدیل ابعاد: (N, 1536) -> (N, 512)
         h = self.alignment(h)
         # ---------------------------------------------------------
         h = h + self.adaptor(h)
-        # A_raw = torch.empty(self.n_classes, h.size(0), ) # N x 1 # Updated -> Tensor
-        A_raw = torch.empty(self.n_classes, h.size(0), device=h.device)
-        # instance_score = torch.empty(1, self.n_classes, h.size(0)).float().to(h.device) # Updated better
-        instance_score = torch.empty(1, self.n_classes, h.size(0), device=h.device).float()
-        for c in range(self.n_classes):
-            A, h = self.attention_nets[c](h)
-            A = torch.transpose(A, 1, 0)  # 1 x N
-            A_raw[c] = A
-            instance_score[0, c] = self.classifiers[c](h)[:, 0]
-        attribute_score = torch.empty(1, self.n_classes, h.size(0)).float().to(h.device)
-        for c in range(self.n_classes):
-            attribute_score[0, c] = instance_score[0, c] * torch.exp(A_raw[c])
+        W_in, b_in, W_c, b_c = self.fused_weights()
+        C, D = W_c.shape
+        # one GEMM for the gated attention inputs of every branch and all instance classifiers
+        a, b, instance_score = torch.split(F.linear(h, W_in, b_in), [C * D, C * D, C], dim=-1)
+        a = self.attention_nets[0].attention_a[1:](a) # tanh (+ dropout)
+        b = self.attention_nets[0].attention_b[1:](b) # sigmoid (+ dropout)
+        gated = a.mul(b).unflatten(-1, (C, D)) # ... x N x C x D
+        A_raw = torch.einsum('...cd,cd->...c', gated, W_c) + b_c # ... x N x C
+        return A_raw.transpose(-1, -2), instance_score.transpose(-1, -2)
+
+    def forward(self, h, mask=None, chunk_size=None):
+        # h: N x 1536 bag, or B x N x 1536 zero-padded bags with a B x N boolean mask of the real instances
+        if chunk_size is not None:
+            if h.dim() != 2:
+                raise ValueError("chunk_size needs a single N x 1536 bag, got a padded batch of shape {}".format(tuple(h.shape)))
+            return self.forward_chunked(h, chunk_size)
+        batched = h.dim() == 3
+        if not batched:
+            h = h.unsqueeze(0)
+        A_raw, instance_score = self.branch_scores(h) # B x C x N
+        exp_A = torch.exp(A_raw)
+        if mask is not None:
+            exp_A = exp_A * mask.unsqueeze(1) # padded instances get no weight
+        attribute_score = instance_score * exp_A # B x C x N
             
-        logits = torch.empty(1, self.n_classes).float().to(h.device)
-        for c in range(self.n_classes):
-            logits[0, c] = torch.sum(attribute_score[0, c], keepdim=True, dim=-1) / torch.sum(torch.exp(A_raw[c]), dim=-1) + self.bias[c]
+        logits = torch.sum(attribute_score, dim=-1) / torch.sum(exp_A, dim=-1) + self.bias # B x C
             
+        Y_hat = torch.topk(logits, 1, dim = 1)[1]
+        Y_prob = F.softmax(logits, dim = 1)
+        results_dict = {}
+        return logits, Y_prob, Y_hat, attribute_score, results_dict
+
+    def forward_chunked(self, h, chunk_size=4096, return_scores=True):
+        '''
+        Inference forward over a single N x 1536 bag in chunks of chunk_size instances.
+        logits = sum(instance_score * exp(A)) / sum(exp(A)) is accumulated with a running max over A,
+        so only one chunk of hidden states lives on the model device at a time. h may stay on the CPU
+        (or be a memory map); the N-length attribute scores are skipped with return_scores=False.
+        Use under torch.no_grad(): with autograd every chunk's activations are kept for backward anyway.
+        '''
+        device = self.bias.device
+        running_max = torch.full((self.n_classes,), float('-inf'), device=device)
+        numerator = torch.zeros(self.n_classes, device=device)
+        denominator = torch.zeros(self.n_classes, device=device)
+        attribute_score = torch.empty(1, self.n_classes, h.size(0), device=device) if return_scores else None
+        for start in range(0, h.size(0), chunk_size):
+            A_raw, instance_score = self.branch_scores(h[start: start + chunk_size].to(device)) # C x n
+            new_max = torch.maximum(running_max, A_raw.max(dim=-1)[0])
+            rescale = torch.exp(running_max - new_max)
+            weight = torch.exp(A_raw - new_max.unsqueeze(-1))
+            numerator = numerator * rescale + torch.sum(instance_score * weight, dim=-1)
+            denominator = denominator * rescale + torch.sum(weight, dim=-1)
+            running_max = new_max
+            if return_scores:
+                attribute_score[0, :, start: start + chunk_size] = instance_score * torch.exp(A_raw)
+
+        logits = (numerator / denominator + self.bias).unsqueeze(0) # 1 x C
         Y_hat = torch.topk(logits, 1, dim = 1)[1]
         Y_prob = F.softmax(logits, dim = 1)
         results_dict = {}
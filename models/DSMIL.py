@@ -61,6 +61,24 @@ class BClassifier(nn.Module):
         C = self.fcc(B) # 1 x C x 1
         C = C.view(1, -1)
         return C, A_raw, B 
+
+    def forward_padded(self, feats, c, mask): # B x N x K, B x N x C, B x N
+        device = feats.device
+        V = self.v(feats) # B x N x V
+        Q = self.q(feats) # B x N x Q
+        
+        # critical instance of every class, never a padded one
+        m_indices = torch.argmax(c.masked_fill(~mask.unsqueeze(-1), float('-inf')), dim=1) # B x C
+        m_feats = torch.gather(feats, 1, m_indices.unsqueeze(-1).expand(-1, -1, feats.shape[-1])) # B x C x K
+        q_max = self.q(m_feats) # B x C x Q
+        A_raw = torch.bmm(Q, q_max.transpose(1, 2)) # B x N x C
+        A = A_raw / torch.sqrt(torch.tensor(Q.shape[-1], dtype=torch.float32, device=device))
+        A = F.softmax(A.masked_fill(~mask.unsqueeze(-1), float('-inf')), 1) # normalize over the real instances of each bag
+        B = torch.bmm(A.transpose(1, 2), V) # B x C x V
+        
+        C = self.fcc(B) # B x C x 1
+        C = C.view(B.shape[0], -1)
+        return C, A_raw, B
     
 class MILNet(nn.Module):
     def __init__(self, feature_dim, n_classes):
@@ -71,9 +89,15 @@ class MILNet(nn.Module):
         self.i_classifier = FCLayer(in_size=feature_dim, out_size=n_classes)
         self.b_classifier = BClassifier(input_size=feature_dim, output_class=n_classes)
         
-    def forward(self, x):
+    def forward(self, x, mask=None):
+        # x: N x K bag, or B x N x K zero-padded bags with a B x N boolean mask of the real instances
         x = self.adapter(x) + x
         feats, classes = self.i_classifier(x)
-        prediction_bag, A, B = self.b_classifier(feats, classes)
+        if x.dim() == 3:
+            if mask is None:
+                mask = torch.ones(x.shape[:2], dtype=torch.bool, device=x.device)
+            prediction_bag, A, B = self.b_classifier.forward_padded(feats, classes, mask)
+        else:
+            prediction_bag, A, B = self.b_classifier(feats, classes)
         
         return classes, prediction_bag, A, B
\ No newline at end of file
@@ -68,7 +68,7 @@ class TransMIL(nn.Module):
 
         #---->cls_token
         B = h.shape[0]
-        cls_tokens = self.cls_token.expand(B, -1, -1).cuda()
+        cls_tokens = self.cls_token.expand(B, -1, -1).to(h.device)
         # print(h.shape, cls_tokens.shape)
         h = torch.cat((cls_tokens, h), dim=1)
 
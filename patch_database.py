@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+PATCH_COLUMNS = ['slide_id', 'class_branch', 'type', 'rank', 'score', 'coord_x', 'coord_y']
+
+
+def write_patch_database(columns, output_path):
+    """
+    Columns as .parquet (pyarrow), .npz or, for any other extension, the original .csv layout. Rows and columns
+    match the former per-row output; scores are identical up to float32 rounding of the fused attention GEMM.
+    """
+    if output_path.endswith('.npz'):
+        np.savez(output_path, **{name: column.astype(str) if column.dtype == object else column
+                                 for name, column in columns.items()})
+        return
+    df_out = pd.DataFrame(columns, columns=PATCH_COLUMNS)
+    if output_path.endswith('.parquet'):
+        df_out.to_parquet(output_path, index=False)
+    else:
+        df_out.to_csv(output_path, index=False)
+
+
+def read_patch_database(path):
+    """The TOP/BOTTOM patch table written by precompute_all_slides, whatever its format."""
+    if path.endswith('.npz'):
+        with np.load(path) as columns:
+            return pd.DataFrame({name: columns[name] for name in PATCH_COLUMNS})
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
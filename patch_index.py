@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import pandas as pd
+
+from patch_database import read_patch_database
+
+LABEL_MAP = {0: 'LUAD', 1: 'LUSC', '0': 'LUAD', '1': 'LUSC'}
+
+
+def build_patch_index(alignment_csv, master_db_csv, db_path):
+    """
+    SQLite copy of the patch database, indexed on (slide_id, class_branch, type, rank), plus the best
+    slide of every concept column of the alignment table, picked with the same sort render_concept used.
+    """
+    tmp_path = db_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    df_align = pd.read_csv(alignment_csv)
+    df_db = read_patch_database(master_db_csv)
+
+    best = []
+    for concept in df_align.columns.drop(['slide_id', 'true_label'], errors='ignore'):
+        best_slide_row = df_align.sort_values(by=concept, ascending=False).iloc[0]
+        raw_label = best_slide_row['true_label']
+        best.append((concept, best_slide_row['slide_id'], str(LABEL_MAP.get(raw_label, raw_label))))
+
+    con = sqlite3.connect(tmp_path)
+    with con:
+        df_db.to_sql('patches', con, index=False)
+        con.execute("CREATE INDEX patches_lookup ON patches (slide_id, class_branch, type, rank)")
+        con.execute("CREATE TABLE concepts (concept TEXT PRIMARY KEY, slide_id TEXT, true_label TEXT)")
+        con.executemany("INSERT INTO concepts VALUES (?, ?, ?)", best)
+        con.execute("CREATE TABLE sources (path TEXT, mtime REAL)")
+        con.executemany("INSERT INTO sources VALUES (?, ?)",
+                        [(os.path.abspath(p), os.path.getmtime(p)) for p in (alignment_csv, master_db_csv)])
+    con.close()
+    os.replace(tmp_path, db_path)
+
+
+class PatchIndex(object):
+    """Read side of build_patch_index: indexed concept -> slide and slide/class/type -> patch lookups."""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # read-only after the build, so render workers may share the connection across threads
+        self.con = sqlite3.connect(db_path, check_same_thread=False)
+
+    @classmethod
+    def open(cls, alignment_csv, master_db_csv, db_path=None):
+        """Open the index kept next to ``master_db_csv``, (re)building it when missing or older than the sources."""
+        db_path = db_path or os.path.splitext(master_db_csv)[0] + '.sqlite'
+        if not os.path.exists(db_path) or cls(db_path).is_stale(alignment_csv, master_db_csv):
+            build_patch_index(alignment_csv, master_db_csv, db_path)
+        return cls(db_path)
+
+    def is_stale(self, *sources):
+        try:
+            recorded = dict(self.con.execute("SELECT path, mtime FROM sources"))
+        except sqlite3.DatabaseError:
+            return True
+        finally:
+            self.con.close()
+        return any(recorded.get(os.path.abspath(p)) != os.path.getmtime(p) for p in sources)
+
+    def close(self):
+        self.con.close()
+
+    def concepts(self):
+        return [row[0] for row in self.con.execute("SELECT concept FROM concepts")]
+
+    def best_slide(self, concept):
+        """(slide_id, true_label) of the slide aligning best with ``concept``, or None for an unknown concept."""
+        return self.con.execute("SELECT slide_id, true_label FROM concepts WHERE concept = ?", (concept,)).fetchone()
+
+    def patches(self, slide_id, class_branch, p_type, limit=3):
+        """The ``limit`` best-ranked TOP or BOTTOM patches of a slide's class branch."""
+        return pd.read_sql_query(
+            "SELECT rank, score, coord_x, coord_y FROM patches "
+            "WHERE slide_id = ? AND class_branch = ? AND type = ? ORDER BY rank LIMIT ?",
+            self.con, params=(slide_id, class_branch, p_type, limit))
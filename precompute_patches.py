@@ -1,60 +1,98 @@
 import os
 import glob
-import pandas as pd
+import numpy as np
 import torch
 import h5py
+from torch.utils.data import Dataset, DataLoader
 from tqdm import tqdm
 from models.AttriMIL import AttriMIL
+from attribute_store import AttributeStore, checkpoint_hash
+from patch_database import PATCH_COLUMNS, write_patch_database
 
 
-def precompute_all_slides(h5_dir, model_weights, output_csv, k=3):
+class SlideBags(Dataset):
+    """(slide_id, features, coords) of every h5 file, read by the DataLoader workers ahead of the model."""
+    def __init__(self, h5_files):
+        self.h5_files = h5_files
+
+    def __len__(self):
+        return len(self.h5_files)
+
+    def __getitem__(self, idx):
+        h5_path = self.h5_files[idx]
+        with h5py.File(h5_path, 'r') as f:
+            features = torch.from_numpy(f['features'][:]).float()
+            coords = f['coords'][:]
+        return os.path.basename(h5_path).replace('.h5', ''), features, coords
+
+
+def extreme_patches(scores, k):
+    """
+    TOP and BOTTOM ``k`` patches of every class branch in one topk call each.
+    scores: C x N. Returns (score, patch index) arrays of shape C x k x 2, the last axis being (TOP, BOTTOM).
+    """
+    actual_k = min(k, scores.shape[1])
+    top_v, top_i = torch.topk(scores, actual_k, dim=1, largest=True)
+    bot_v, bot_i = torch.topk(scores, actual_k, dim=1, largest=False)
+    values = torch.stack([top_v, bot_v], dim=-1).cpu().numpy()
+    indices = torch.stack([top_i, bot_i], dim=-1).cpu().numpy()
+    return values, indices
+
+
+def precompute_all_slides(h5_dir, model_weights, output_csv, k=3, chunk_size=None,
+                          class_names=('LUAD', 'LUSC'), num_workers=4, score_store=None):
+    """TOP/BOTTOM k patches per class to ``output_csv``; with ``score_store`` every patch's scores also go to an AttributeStore."""
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = AttriMIL()
+    model = AttriMIL(n_classes=len(class_names))
 
     state_dict = torch.load(model_weights, map_location=device)
     model.load_state_dict(state_dict)
 
     model.to(device)
     model.eval()
-    
+
     h5_files = glob.glob(os.path.join(h5_dir, "*.h5"))
-    
-    all_data = []
-    
-    for h5_path in tqdm(h5_files):
-        slide_id = os.path.basename(h5_path).replace('.h5', '')
-        
-        with h5py.File(h5_path, 'r') as f:
-            features = torch.tensor(f['features'][:], dtype=torch.float32).to(device)
-            coords = f['coords'][:]
-            
+    # batch_size=None: one slide per item, no collation; workers read the next slides while the model runs
+    loader = DataLoader(SlideBags(h5_files), batch_size=None, num_workers=num_workers,
+                        pin_memory=device.type == 'cuda', prefetch_factor=2 if num_workers > 0 else None)
+
+    parts = {name: [] for name in PATCH_COLUMNS}
+    store = AttributeStore(score_store, 'a') if score_store else None
+    ckpt = checkpoint_hash(model_weights) if score_store else None
+    n_classes = len(class_names)
+
+    for slide_id, features, coords in tqdm(loader, total=len(h5_files)):
+        if chunk_size is None:
+            features = features.to(device, non_blocking=True)  # chunked forward moves one chunk at a time
+
         with torch.no_grad():
-            _, _, _, attribute_score, _ = model(features)
-            scores = attribute_score.squeeze() 
-            
-        actual_k = min(k, scores.shape[1])
-        
-        for class_idx, class_name in enumerate(['LUAD', 'LUSC']):
-            class_scores = scores[class_idx]
-            top_v, top_i = torch.topk(class_scores, actual_k, largest=True)
-            bot_v, bot_i = torch.topk(class_scores, actual_k, largest=False)
-            
-            for i in range(actual_k):
-                # TOP
-                all_data.append({'slide_id': slide_id, 'class_branch': class_name,
-                                 'type': 'TOP', 'rank': i+1, 'score': top_v[i].item(), 
-                                 'coord_x': coords[top_i[i]][0], 'coord_y': coords[top_i[i]][1]})
-                # BOTTOM
-                all_data.append({'slide_id': slide_id, 'class_branch': class_name,
-                                 'type': 'BOTTOM', 'rank': i+1, 'score': bot_v[i].item(), 
-                                 'coord_x': coords[bot_i[i]][0], 'coord_y': coords[bot_i[i]][1]})
-                
-    df_out = pd.DataFrame(all_data)
-    df_out.to_csv(output_csv, index=False)
+            _, _, _, attribute_score, _ = model(features, chunk_size=chunk_size)
+            scores = attribute_score.reshape(n_classes, -1)
+
+        values, indices = extreme_patches(scores, k)
+        if store is not None:
+            store.put(slide_id, scores.cpu().numpy(), coords, ckpt, class_names)
+        actual_k = values.shape[1]
+        n_rows = values.size
+
+        # rows ordered class -> rank -> (TOP, BOTTOM), as the per-row loop wrote them
+        parts['slide_id'].append(np.full(n_rows, slide_id, dtype=object))
+        parts['class_branch'].append(np.repeat(np.asarray(class_names, dtype=object), 2 * actual_k))
+        parts['type'].append(np.tile(np.array(['TOP', 'BOTTOM'], dtype=object), n_classes * actual_k))
+        parts['rank'].append(np.tile(np.repeat(np.arange(1, actual_k + 1), 2), n_classes))
+        parts['score'].append(values.reshape(-1).astype(np.float64))
+        patch_coords = coords[indices.reshape(-1)]
+        parts['coord_x'].append(patch_coords[:, 0])
+        parts['coord_y'].append(patch_coords[:, 1])
+
+    if store is not None:
+        store.close()
+    columns = {name: np.concatenate(chunks) if chunks else np.array([]) for name, chunks in parts.items()}
+    write_patch_database(columns, output_csv)
 
 if __name__ == "__main__":
     H5_DIR = "/content/AttriMIL_Workspace/data/h5_coords_files"
     WEIGHTS = "/content/drive/MyDrive/AttriMIL_Backup/save_weights/tcga_nsclc_100/s_0_checkpoint.pt"
     OUT_CSV = "/content/AttriMIL-LungCancer/evaluation_results/master_patch_database.csv"
-    
-    precompute_all_slides(H5_DIR, WEIGHTS, OUT_CSV)
\ No newline at end of file
+
+    precompute_all_slides(H5_DIR, WEIGHTS, OUT_CSV)
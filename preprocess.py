@@ -0,0 +1,147 @@
+import os
+import csv
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import h5py
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from tqdm import tqdm
+
+from create_nearest import grid_nearest
+
+MANIFEST_FIELDS = ['slide_id', 'source', 'n_patches', 'neighbours', 'status']
+
+
+def knn_nearest(coords, k=8):
+    """The k nearest patches of every patch (self excluded), as in create_nearest; small bags are padded with self-indices."""
+    n = len(coords)
+    nearest = np.repeat(np.arange(n)[:, None], k, axis=1)
+    if n > 1:
+        nbrs = NearestNeighbors(n_neighbors=min(k + 1, n), algorithm='ball_tree').fit(coords)
+        _, indices = nbrs.kneighbors(coords)
+        nearest[:, :indices.shape[1] - 1] = indices[:, 1:]
+    return nearest
+
+
+def read_raw(path):
+    """features and coords of a raw extractor file, without the leading batch dimension some extractors write."""
+    with h5py.File(path, 'r') as f:
+        features = f['features'][()]
+        coords = f['coords'][()]
+    if features.ndim == 3 and features.shape[0] == 1:
+        features = features[0]
+    if coords.ndim == 3 and coords.shape[0] == 1:
+        coords = coords[0]
+    if len(features) != len(coords):
+        raise ValueError("{} features but {} coords".format(len(features), len(coords)))
+    return features, coords
+
+
+def process_slide(source, target, neighbours='knn', patch_size=(256, 256), radius=1):
+    """Read one raw file once, build its neighbour graph and write the AttriMIL h5 atomically."""
+    features, coords = read_raw(source)
+    if neighbours == 'grid':
+        nearest = grid_nearest(coords, patch_size, radius, include_self=False)
+    else:
+        nearest = knn_nearest(coords)
+
+    tmp = target + '.tmp'
+    with h5py.File(tmp, 'w') as h5_out:
+        h5_out.create_dataset('features', data=features)
+        h5_out.create_dataset('coords', data=coords)
+        h5_out.create_dataset('nearest', data=nearest)
+    os.replace(tmp, target)  # readers never see a half-written file
+    return len(coords)
+
+
+def read_manifest(path):
+    """slide_id -> row of every slide already written successfully."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['slide_id']: row for row in csv.DictReader(f) if row['status'] == 'done'}
+
+
+def preprocess(raw_dirs, save_dir, neighbours='knn', patch_size=(256, 256), radius=1,
+               workers=4, manifest=None, overwrite=False):
+    """
+    Convert every raw ``.h5`` of ``raw_dirs`` into ``save_dir/<slide_id>.h5`` with features, coords and nearest.
+    Progress is appended to ``manifest`` (default ``save_dir/manifest.csv``) as each slide finishes, so an
+    interrupted run resumes where it stopped. The raw files are left untouched.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    manifest = manifest or os.path.join(save_dir, 'manifest.csv')
+    done = {} if overwrite else read_manifest(manifest)
+
+    jobs = {}
+    for data_dir in raw_dirs:
+        if not os.path.isdir(data_dir):
+            print("skipping missing directory:", data_dir)
+            continue
+        for name in sorted(os.listdir(data_dir)):
+            if not name.endswith('.h5'):
+                continue
+            slide_id = name[:-3]
+            if slide_id in jobs:
+                print("duplicate slide {} in {}, keeping {}".format(slide_id, data_dir, jobs[slide_id]))
+                continue
+            jobs[slide_id] = os.path.join(data_dir, name)
+    todo = {slide_id: source for slide_id, source in jobs.items()
+            if slide_id not in done or not os.path.exists(os.path.join(save_dir, slide_id + '.h5'))}
+    print("{} slides found, {} already done, {} to process".format(len(jobs), len(jobs) - len(todo), len(todo)))
+
+    new_manifest = not os.path.exists(manifest) or overwrite
+    with open(manifest, 'w' if new_manifest else 'a', newline='') as log, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = csv.DictWriter(log, fieldnames=MANIFEST_FIELDS)
+        if new_manifest:
+            writer.writeheader()
+        futures = {pool.submit(process_slide, source, os.path.join(save_dir, slide_id + '.h5'),
+                               neighbours, tuple(patch_size), radius): slide_id
+                   for slide_id, source in todo.items()}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            slide_id = futures[future]
+            row = {'slide_id': slide_id, 'source': todo[slide_id], 'neighbours': neighbours}
+            try:
+                row.update(n_patches=future.result(), status='done')
+                done[slide_id] = row
+            except Exception as e:
+                print("Error processing {}: {}".format(slide_id, e))
+                row.update(n_patches=0, status='failed')
+            writer.writerow(row)
+            log.flush()
+    return sorted(slide_id for slide_id in done if slide_id in jobs)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Single-pass conversion of raw feature files into AttriMIL h5 files")
+    parser.add_argument('--raw_dirs', type=str, nargs='+',
+                        default=['/content/extracted_features/TCGA-LUAD', '/content/extracted_features/TCGA-LUSC'],
+                        help='directories of raw extractor .h5 files (features and coords)')
+    parser.add_argument('--save_dir', type=str,
+                        default='/content/AttriMIL_Workspace/data/h5_coords_files',
+                        help='output directory of <slide_id>.h5 files with features/coords/nearest')
+    parser.add_argument('--neighbours', type=str, choices=['knn', 'grid'], default='knn',
+                        help='knn: 8 nearest patches (ball tree); grid: patch-grid neighbours from grid_nearest')
+    parser.add_argument('--patch_size', type=int, nargs=2, default=[256, 256],
+                        help='grid step of the coords, used with --neighbours grid')
+    parser.add_argument('--radius', type=int, default=1,
+                        help='grid neighbourhood radius, used with --neighbours grid')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker processes')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='resume manifest (default: <save_dir>/manifest.csv)')
+    parser.add_argument('--overwrite', action='store_true', default=False,
+                        help='ignore the manifest and process every slide again')
+    parser.add_argument('--store_dir', type=str, default=None,
+                        help='also pack the processed slides into a feature store (see feature_store.py)')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    slide_ids = preprocess(args.raw_dirs, args.save_dir, args.neighbours, args.patch_size, args.radius,
+                           args.workers, args.manifest, args.overwrite)
+    if args.store_dir:
+        from feature_store import build_feature_store
+        store = build_feature_store(args.save_dir, args.store_dir, slide_ids)
+        print("Packed {} slides into {}".format(len(store), args.store_dir))
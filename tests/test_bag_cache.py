@@ -0,0 +1,37 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bag_cache import SharedBagCache
+
+
+def test_bags_outlive_later_lookups():
+    # each bag fills the whole budget, so every put evicts the previous one and every new attach
+    # pushes the older mapping out of the local LRU
+    cache = SharedBagCache(1000)
+    try:
+        cache.put('0', (np.ones(200, np.float32),))
+        first = cache.get('0')
+        cache.put('1', (np.full(200, 2, np.float32),))
+        second = cache.get('1')
+        assert first[0].sum() == 200
+        assert second[0].sum() == 400
+        assert cache.info()['evictions'] == 1
+    finally:
+        cache.close()
+
+
+def test_get_returns_writable_copies():
+    cache = SharedBagCache(1 << 20)
+    try:
+        features, coords = np.arange(12, dtype=np.float32).reshape(3, 4), np.arange(6).reshape(3, 2)
+        assert cache.put('bag', (features, coords))
+        bag = cache.get('bag')
+        bag[0][...] = -1
+        np.testing.assert_array_equal(cache.get('bag')[0], features)
+        np.testing.assert_array_equal(cache.get('bag')[1], coords)
+        assert cache.get('missing') is None
+        assert cache.info()['hits'] == 3 and cache.info()['misses'] == 1
+    finally:
+        cache.close()
@@ -0,0 +1,123 @@
+import io
+import os
+import sys
+import json
+import struct
+import urllib.error
+import urllib.request
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attribute_store import AttributeStore
+from tile_server import OPENSEADRAGON_URL, TileRenderer, TileServer
+
+WIDTH, HEIGHT, PATCH = 1000, 700, 256
+
+
+def write_tiled_tiff(path, image, tile=128):
+    """Uncompressed RGB TIFF stored in ``tile`` x ``tile`` tiles (PIL only writes strips)."""
+    height, width = image.shape[:2]
+    rows, cols = -(-height // tile), -(-width // tile)
+    padded = np.zeros((rows * tile, cols * tile, 3), dtype=np.uint8)
+    padded[:height, :width] = image
+    tiles = [padded[r * tile:(r + 1) * tile, c * tile:(c + 1) * tile].tobytes() for r in range(rows) for c in range(cols)]
+    tile_bytes = len(tiles[0])
+    bits_offset = 8 + len(tiles) * tile_bytes
+    offsets_offset = bits_offset + 6
+    counts_offset = offsets_offset + 4 * len(tiles)
+    ifd_offset = counts_offset + 4 * len(tiles)
+    entries = [(256, 4, 1, width), (257, 4, 1, height), (258, 3, 3, bits_offset), (259, 3, 1, 1), (262, 3, 1, 2),
+               (277, 3, 1, 3), (284, 3, 1, 1), (322, 3, 1, tile), (323, 3, 1, tile),
+               (324, 4, len(tiles), offsets_offset), (325, 4, len(tiles), counts_offset)]
+    with open(path, 'wb') as f:
+        f.write(b'II*\x00' + struct.pack('<I', ifd_offset))
+        f.write(b''.join(tiles))
+        f.write(struct.pack('<3H', 8, 8, 8))
+        f.write(struct.pack('<{}I'.format(len(tiles)), *(8 + k * tile_bytes for k in range(len(tiles)))))
+        f.write(struct.pack('<{}I'.format(len(tiles)), *([tile_bytes] * len(tiles))))
+        f.write(struct.pack('<H', len(entries)))
+        for entry in entries:
+            f.write(struct.pack('<HHII', *entry))
+        f.write(struct.pack('<I', 0))
+
+
+def fetch(url):
+    with urllib.request.urlopen(url) as response:
+        return response.read()
+
+
+def fetch_image(url):
+    return np.asarray(Image.open(io.BytesIO(fetch(url))).convert('RGB'))
+
+
+def status(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+@pytest.fixture
+def slide(tmp_path):
+    rng = np.random.RandomState(0)
+    image = (rng.rand(HEIGHT, WIDTH, 3) * 255).astype(np.uint8)
+    slide_dir = tmp_path / 'slides'
+    slide_dir.mkdir()
+    write_tiled_tiff(str(slide_dir / 'SLIDE-1.tif'), image)
+    # patches only cover x < 512, so tiles right of that carry no overlay
+    coords = np.stack(np.meshgrid(np.arange(0, 512, PATCH), np.arange(0, HEIGHT, PATCH)), -1).reshape(-1, 2)
+    store_path = str(tmp_path / 'scores.h5')
+    with AttributeStore(store_path, 'w') as store:
+        store.put('SLIDE-1', rng.rand(2, len(coords)), coords, 'ckpt', ['LUAD', 'LUSC'])
+    return image, str(slide_dir), store_path
+
+
+def test_tiles_of_a_tiled_tiff(slide):
+    image, slide_dir, store_path = slide
+    renderer = TileRenderer(slide_dir, store_path, tile_size=256, patch_size=PATCH)
+    try:
+        with TileServer(renderer) as server:
+            url = server.base_url
+            assert json.loads(fetch(url + '/')) == {'slides': ['SLIDE-1'], 'overlays': ['none', 'LUAD', 'LUSC']}
+            assert 'Width="{}" Height="{}"'.format(WIDTH, HEIGHT) in fetch(url + '/SLIDE-1/LUAD.dzi').decode()
+
+            # level 10 is full resolution: plain tiles are crops of the slide, edge tiles are cut to the slide
+            np.testing.assert_array_equal(fetch_image(url + '/SLIDE-1/none_files/10/0_0.png'), image[:256, :256])
+            np.testing.assert_array_equal(fetch_image(url + '/SLIDE-1/none_files/10/3_2.png'), image[512:, 768:])
+            assert fetch_image(url + '/SLIDE-1/LUSC_files/0/0_0.png').shape == (1, 1, 3)
+
+            overlay = fetch_image(url + '/SLIDE-1/LUAD_files/10/0_0.png')
+            assert overlay.shape == (256, 256, 3) and not np.array_equal(overlay, image[:256, :256])
+            np.testing.assert_array_equal(fetch_image(url + '/SLIDE-1/LUAD_files/10/3_0.png'), image[:256, 768:])
+
+            hits = renderer.cache.hits
+            assert fetch(url + '/SLIDE-1/LUAD_files/10/0_0.png') == fetch(url + '/SLIDE-1/LUAD_files/10/0_0.png')
+            assert renderer.cache.hits == hits + 2
+
+            for path in ['/SLIDE-2/LUAD.dzi', '/SLIDE-1/XX_files/10/0_0.png', '/SLIDE-1/LUAD_files/11/0_0.png',
+                         '/SLIDE-1/LUAD_files/10/4_0.png', '/nothing']:
+                assert status(url + path) == 404, path
+    finally:
+        renderer.close()
+
+
+def test_viewer_loads_openseadragon_from_a_local_copy(slide, tmp_path):
+    _, slide_dir, store_path = slide
+    osd_dir = tmp_path / 'openseadragon'
+    (osd_dir / 'images').mkdir(parents=True)
+    (osd_dir / 'openseadragon.min.js').write_text('var OpenSeadragon;')
+    renderer = TileRenderer(slide_dir, store_path)
+    try:
+        with TileServer(renderer) as server:
+            assert OPENSEADRAGON_URL + '/openseadragon.min.js' in fetch(server.base_url + '/view/SLIDE-1/LUAD').decode()
+        with TileServer(renderer, openseadragon=str(osd_dir)) as server:
+            page = fetch(server.base_url + '/view/SLIDE-1/LUAD').decode()
+            assert '"/openseadragon/openseadragon.min.js"' in page and 'cdn' not in page
+            assert fetch(server.base_url + '/openseadragon/openseadragon.min.js') == b'var OpenSeadragon;'
+            assert status(server.base_url + '/openseadragon/images') == 404
+            assert status(server.base_url + '/openseadragon/../scores.h5') == 404
+    finally:
+        renderer.close()
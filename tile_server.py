@@ -0,0 +1,336 @@
+import os
+import io
+import re
+import json
+import math
+import mimetypes
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+from attribute_store import AttributeStore
+from heatmap import rasterise_scores, colourise, blend, deepzoom_levels, DZI_TEMPLATE, openslide
+
+SLIDE_EXTENSIONS = ['.svs', '.tif', '.tiff', '.ndpi', '.mrxs', '.png', '.jpg']
+TILE_PATH = re.compile(r'^/([^/]+)/([^/]+)_files/(\d+)/(\d+)_(\d+)\.(png|jpeg)$')
+DZI_PATH = re.compile(r'^/([^/]+)/([^/]+)\.dzi$')
+# where the viewer page loads OpenSeadragon from; a local copy of the build directory keeps the viewer offline
+OPENSEADRAGON_URL = 'https://cdn.jsdelivr.net/npm/openseadragon@4/build/openseadragon'
+VIEWER_PAGE = '''<!DOCTYPE html>
+<html><head><title>{slide} | {overlay}</title>
+<script src="{osd}/openseadragon.min.js"></script></head>
+<body style="margin:0"><div id="view" style="width:100vw;height:100vh"></div>
+<script>OpenSeadragon({{id: "view", prefixUrl: "{osd}/images/", tileSources: "/{slide}/{overlay}.dzi"}});</script>
+</body></html>
+'''
+
+
+class OpenSlideSource(object):
+    """Level-0 regions of a WSI, read from the pyramid level closest to the requested downsample."""
+    def __init__(self, path):
+        self.slide = openslide.OpenSlide(path)
+        self.dimensions = self.slide.dimensions
+
+    def read(self, x, y, width, height, size):
+        level = self.slide.get_best_level_for_downsample(max(width / size[0], 1.))
+        scale = self.slide.level_downsamples[level]
+        region = self.slide.read_region((x, y), level, (max(int(math.ceil(width / scale)), 1),
+                                                        max(int(math.ceil(height / scale)), 1)))
+        return region.convert('RGB').resize(size, Image.BILINEAR)
+
+    def close(self):
+        self.slide.close()
+
+
+class ImageSource(object):
+    """Any image PIL can open (e.g. a synthetic tiled TIFF) read as a single-level slide."""
+    def __init__(self, path):
+        Image.MAX_IMAGE_PIXELS = None
+        self.image = Image.open(path).convert('RGB')
+        self.dimensions = self.image.size
+        self._lock = threading.Lock()
+
+    def read(self, x, y, width, height, size):
+        with self._lock:
+            region = self.image.crop((x, y, x + width, y + height))
+        return region.resize(size, Image.BILINEAR)
+
+    def close(self):
+        self.image.close()
+
+
+class BlankSource(object):
+    """A white slide of the given size, for overlays of stored scores whose WSI is not on disk."""
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def read(self, x, y, width, height, size):
+        return Image.new('RGB', size, (255, 255, 255))
+
+    def close(self):
+        pass
+
+
+def open_source(path):
+    if openslide is not None and not path.lower().endswith(('.png', '.jpg')):
+        try:
+            return OpenSlideSource(path)
+        except Exception:  # OpenSlide cannot read plain (non-pyramidal) TIFFs; PIL can
+            pass
+    return ImageSource(path)
+
+
+class TileCache(object):
+    """Thread-safe LRU of encoded tiles."""
+    def __init__(self, max_tiles=2048):
+        self.max_tiles = max_tiles
+        self.hits = self.misses = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return self._tiles[key]
+            self.misses += 1
+        return None
+
+    def put(self, key, tile):
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+class TileRenderer(object):
+    """
+    DeepZoom tiles of the slides in ``slide_dir``, optionally with the attribute overlay of one class branch from an
+    AttributeStore (``overlay`` 'none' for the plain slide). Tiles are rendered on request and kept in a TileCache;
+    the overlay of a tile is rasterised from the patches intersecting it, coloured on the slide-wide score range.
+    """
+    def __init__(self, slide_dir=None, store_path=None, ckpt=None, tile_size=256, patch_size=512, alpha=0.4,
+                 cmap='jet', max_tiles=2048):
+        self.slide_dir = slide_dir
+        self.store = AttributeStore(store_path) if store_path else None
+        self.ckpt = ckpt
+        self.tile_size = tile_size
+        self.patch_size = patch_size
+        self.alpha = alpha
+        self.cmap = cmap
+        self.cache = TileCache(max_tiles)
+        self._sources = {}
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        for source in self._sources.values():
+            source.close()
+        self._sources = {}
+        if self.store is not None:
+            self.store.close()
+
+    def slides(self):
+        slides = set()
+        if self.slide_dir and os.path.isdir(self.slide_dir):
+            slides.update(os.path.splitext(f)[0] for f in os.listdir(self.slide_dir)
+                          if os.path.splitext(f)[1].lower() in SLIDE_EXTENSIONS)
+        if self.store is not None:
+            slides.update(self.store.slides(self.ckpt))
+        return sorted(slides)
+
+    def overlays(self):
+        return ['none'] + (self.store.class_names(self.ckpt) if self.store is not None else [])
+
+    def _slide_scores(self, slide_id):
+        with self._lock:
+            if slide_id not in self._scores:
+                if self.store is None or slide_id not in self.store.slides(self.ckpt):
+                    raise KeyError(slide_id)
+                self._scores[slide_id] = self.store.get(slide_id, self.ckpt)
+            return self._scores[slide_id]
+
+    def source(self, slide_id):
+        with self._lock:
+            if slide_id in self._sources:
+                return self._sources[slide_id]
+        path = None
+        for extension in SLIDE_EXTENSIONS:
+            candidate = os.path.join(self.slide_dir or '', slide_id + extension)
+            if self.slide_dir and os.path.exists(candidate):
+                path = candidate
+                break
+        if path is not None:
+            source = open_source(path)
+        else:
+            _, coords = self._slide_scores(slide_id)
+            extent = coords.max(axis=0) + self.patch_size if len(coords) else np.ones(2, dtype=np.int64)
+            source = BlankSource((int(extent[0]), int(extent[1])))
+        with self._lock:
+            existing = self._sources.setdefault(slide_id, source)
+        if existing is not source:  # another request opened it first
+            source.close()
+        return existing
+
+    def dzi(self, slide_id, fmt='png'):
+        width, height = self.source(slide_id).dimensions
+        return DZI_TEMPLATE.format(fmt=fmt, tile=self.tile_size, width=width, height=height)
+
+    def tile(self, slide_id, overlay, level, col, row, fmt='png'):
+        """Encoded bytes of one DeepZoom tile; raises KeyError for an unknown slide, overlay or tile."""
+        key = (slide_id, overlay, level, col, row, fmt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        source = self.source(slide_id)
+        levels = deepzoom_levels(*source.dimensions)
+        if level >= len(levels):
+            raise KeyError(key)
+        level_width, level_height = levels[level]
+        scale = 2 ** (len(levels) - 1 - level)  # level-0 pixels per tile pixel
+        left, top = col * self.tile_size, row * self.tile_size
+        if left >= level_width or top >= level_height:
+            raise KeyError(key)
+        size = (min(self.tile_size, level_width - left), min(self.tile_size, level_height - top))
+        x, y = left * scale, top * scale
+        image = source.read(x, y, size[0] * scale, size[1] * scale, size)
+
+        if overlay != 'none':
+            image = Image.fromarray(self._overlay(np.asarray(image), slide_id, overlay, x, y, scale))
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt.upper())
+        data = buffer.getvalue()
+        self.cache.put(key, data)
+        return data
+
+    def _overlay(self, image, slide_id, overlay, x, y, scale):
+        if self.store is None or overlay not in self.store.class_names(self.ckpt):
+            raise KeyError(overlay)
+        scores, coords = self._slide_scores(slide_id)
+        class_scores = scores[self.store.class_names(self.ckpt).index(overlay)]
+        height, width = image.shape[:2]
+        inside = ((coords[:, 0] + self.patch_size > x) & (coords[:, 0] < x + width * scale) &
+                  (coords[:, 1] + self.patch_size > y) & (coords[:, 1] < y + height * scale))
+        if not inside.any():
+            return image
+        grid = rasterise_scores(class_scores[inside], coords[inside] - np.array([x, y]), (height, width), scale,
+                                self.patch_size)
+        vmin, vmax = (float(class_scores.min()), float(class_scores.max())) if len(class_scores) else (0., 1.)
+        return blend(image, colourise(grid, self.cmap, vmin, vmax), self.alpha)
+
+
+class TileServer(object):
+    """
+    Local HTTP server (stdlib, one thread per request) for a TileRenderer:
+
+    * ``/`` lists the slides and overlays as JSON
+    * ``/<slide>/<overlay>.dzi`` and ``/<slide>/<overlay>_files/<level>/<col>_<row>.png`` are DeepZoom sources
+    * ``/view/<slide>/<overlay>`` is an OpenSeadragon viewer page
+
+    ``openseadragon`` is the URL of the OpenSeadragon build directory the viewer loads, or a local copy of it,
+    which is then served under ``/openseadragon/`` so the viewer needs no network access.
+    Use as a context manager (serving in a background thread) or call ``serve_forever``.
+    """
+    def __init__(self, renderer, host='127.0.0.1', port=0, openseadragon=OPENSEADRAGON_URL):
+        self.renderer = renderer
+        self.osd_dir = os.path.abspath(openseadragon) if os.path.isdir(openseadragon) else None
+        self.osd_url = '/openseadragon' if self.osd_dir else openseadragon.rstrip('/')
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.base_url = "http://{}:{}".format(*self.server.server_address)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def serve_forever(self):
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.renderer.close()
+
+    def _static(self, path):
+        """(bytes, content type) of a file of the local OpenSeadragon copy; raises KeyError outside of it."""
+        if self.osd_dir is None:
+            raise KeyError(path)
+        full_path = os.path.abspath(os.path.join(self.osd_dir, path))
+        if not full_path.startswith(self.osd_dir + os.sep) or not os.path.isfile(full_path):
+            raise KeyError(path)
+        with open(full_path, 'rb') as f:
+            return f.read(), mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    def _handler(self):
+        server = self
+        renderer = self.renderer
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                try:
+                    match = TILE_PATH.match(path)
+                    if match:
+                        slide_id, overlay, level, col, row, fmt = match.groups()
+                        data = renderer.tile(slide_id, overlay, int(level), int(col), int(row), fmt)
+                        return self._send(200, data, 'image/' + fmt)
+                    match = DZI_PATH.match(path)
+                    if match:
+                        return self._send(200, renderer.dzi(match.group(1)).encode(), 'application/xml')
+                    if path.startswith('/view/') and path.count('/') == 3:
+                        _, _, slide_id, overlay = path.split('/')
+                        page = VIEWER_PAGE.format(slide=slide_id, overlay=overlay, osd=server.osd_url)
+                        return self._send(200, page.encode(), 'text/html')
+                    if path.startswith('/openseadragon/'):
+                        return self._send(200, *server._static(path[len('/openseadragon/'):]))
+                    if path == '/':
+                        body = json.dumps({'slides': renderer.slides(), 'overlays': renderer.overlays()})
+                        return self._send(200, body.encode(), 'application/json')
+                except KeyError:
+                    pass
+                self._send(404, b'not found', 'text/plain')
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='DeepZoom tile server for WSIs with attribute overlays')
+    parser.add_argument('--slide_dir', type=str, default=None)
+    parser.add_argument('--store', type=str, default=None, help='AttributeStore HDF5 file (precompute_patches.py score_store=)')
+    parser.add_argument('--ckpt', type=str, default=None, help='checkpoint hash, when the store holds several')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--tile_size', type=int, default=256)
+    parser.add_argument('--patch_size', type=int, default=512, help='level-0 size of a patch')
+    parser.add_argument('--alpha', type=float, default=0.4)
+    parser.add_argument('--max_tiles', type=int, default=2048, help='tiles kept in the LRU cache')
+    parser.add_argument('--openseadragon', type=str, default=OPENSEADRAGON_URL,
+                        help='URL or local copy of the OpenSeadragon build directory used by the viewer')
+    args = parser.parse_args()
+
+    renderer = TileRenderer(args.slide_dir, args.store, args.ckpt, args.tile_size, args.patch_size, args.alpha,
+                            max_tiles=args.max_tiles)
+    server = TileServer(renderer, args.host, args.port, args.openseadragon)
+    print("Serving {} slides at {}/view/<slide>/<overlay>".format(len(renderer.slides()), server.base_url))
+    server.serve_forever()
@@ -1,6 +1,7 @@
 from dataloader import Generic_WSI_Classification_Dataset, Generic_MIL_Dataset
 
 import os
+import argparse
 import torch
 from torch import nn
 import torch.optim as optim
@@ -17,8 +18,7 @@ from sklearn.metrics import auc as calc_auc
 from models.AttriMIL import AttriMIL
 from utils import *
 
-from constraints import spatial_constraint, rank_constraint
-import queue
+from constraints import spatial_constraint, rank_constraint, ExemplarBank
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -124,7 +124,9 @@ def train_abmil(datasets,
                 fold = 0,
                 writer_flag = True,
                 max_epoch = 200,
-                early_stopping = True,):
+                early_stopping = True,
+                batch_size = 1,
+                bank_size = 4,):
     
     writer_dir = os.path.join(save_path, str(fold))
     if not os.path.isdir(writer_dir):
@@ -152,7 +154,7 @@ def train_abmil(datasets,
     optimizer = optim.SGD(filter(lambda p: p.requires_grad, model.parameters()), lr=2e-4, momentum=0.9, weight_decay=1e-5)
     
     print('\nInit Loaders...', end=' ')
-    train_loader = get_split_loader(train_split, training=True, testing = False, weighted = True)
+    train_loader = get_split_loader(train_split, training=True, testing = False, weighted = True, batch_size = batch_size)
     val_loader = get_split_loader(val_split,  testing = False)
     test_loader = get_split_loader(test_split, testing = False)
     print('Done!')
@@ -161,7 +163,7 @@ def train_abmil(datasets,
     retain = 0
     
     for epoch in range(max_epoch):
-        train_loop(epoch, model, train_loader, optimizer, n_classes, writer, loss_fn)
+        train_loop(epoch, model, train_loader, optimizer, n_classes, writer, loss_fn, bank_size)
         loss = validate(epoch, model, val_loader, n_classes, writer, loss_fn)
         if epoch % 10 == 0:
             torch.save(model.state_dict(), os.path.join(save_path, 's_{}_checkpoint_{}.pt'.format(fold, epoch)))
@@ -181,7 +183,7 @@ def train_abmil(datasets,
     model.load_state_dict(torch.load(os.path.join(save_path, 's_{}_checkpoint.pt'.format(fold))))
     summary(model, test_loader, n_classes)
     
-def train_loop(epoch, model, loader, optimizer, n_classes, writer, loss_fn):
+def train_loop(epoch, model, loader, optimizer, n_classes, writer, loss_fn, bank_size=4):
     model.train()
     acc_logger = Accuracy_Logger(n_classes=n_classes)
     train_loss = 0.
@@ -191,24 +193,36 @@ def train_loop(epoch, model, loader, optimizer, n_classes, writer, loss_fn):
     print('\n')
     
         
-    label_positive_list = []
-    label_negative_list = []
-    for i in range(n_classes):
-        label_positive_list.append(queue.Queue(maxsize=4))
-        label_negative_list.append(queue.Queue(maxsize=4))
+    bank = ExemplarBank(n_classes, size=bank_size)
         
-    for batch_idx, (data, label, coords, nearest) in enumerate(loader):
+    for batch_idx, (data, label, coords, nearest, *mask) in enumerate(loader):
         data, label = data.to(device), label.to(device)
         
-        # حذف بُعد اضافی
-        data = data.squeeze(0)
-        nearest = nearest.squeeze(0).to(device)
-        
-        logits, Y_prob, Y_hat, attribute_score, results_dict = model(data)
-        acc_logger.log(Y_hat, label)
-        loss_bag = loss_fn(logits, label)
-        loss_spa = spatial_constraint(attribute_score, n_classes, nearest, ks=3)
-        loss_rank, label_positive_list, label_negative_list = rank_constraint(data, label, model, attribute_score, n_classes, label_positive_list, label_negative_list)
+        if mask:
+            # padded bag batch (batch_size > 1): one forward for all bags, constraints per bag
+            mask = mask[0].to(device)
+            nearest = nearest.to(device)
+            logits, Y_prob, Y_hat, attribute_score, results_dict = model(data, mask)
+            acc_logger.log_batch(Y_hat.view(-1).cpu().numpy(), label.cpu().numpy())
+            loss_bag = loss_fn(logits, label)
+            loss_spa = torch.tensor(0.0).to(device)
+            loss_rank = torch.tensor(0.0).to(device)
+            for b, n in enumerate(mask.sum(dim=1).tolist()):
+                bag_score = attribute_score[b:b + 1, :, :n]
+                loss_spa = loss_spa + spatial_constraint(bag_score, n_classes, nearest[b, :n], ks=3)
+                loss_rank = loss_rank + rank_constraint(data[b, :n], label[b], model, bag_score, n_classes, bank)
+            loss_spa = loss_spa / data.size(0)
+            loss_rank = loss_rank / data.size(0)
+        else:
+            # حذف بُعد اضافی
+            data = data.squeeze(0)
+            nearest = nearest.squeeze(0).to(device)
+            
+            logits, Y_prob, Y_hat, attribute_score, results_dict = model(data)
+            acc_logger.log(Y_hat, label)
+            loss_bag = loss_fn(logits, label)
+            loss_spa = spatial_constraint(attribute_score, n_classes, nearest, ks=3)
+            loss_rank = rank_constraint(data, label, model, attribute_score, n_classes, bank)
 
         loss = loss_bag + 1.0 * loss_spa + 5.0 * loss_rank
         
@@ -224,7 +238,7 @@ def train_loop(epoch, model, loader, optimizer, n_classes, writer, loss_fn):
         if (batch_idx + 1) % 20 == 0:
             # print('batch {}, loss: {:.4f}, loss_bag: {:.4f}, loss_spa: {:.4f}, bag_size: {}'.format(batch_idx, loss_value, loss_bag_value, loss_spa_value, label.item(), data.size(0))) # اشتباه چاپ میکنه!
             # هم لیبل و هم تعداد پچ‌ها (bag_size) رو به درستی چاپ می‌کنیم
-            print('batch {}, loss: {:.4f}, loss_bag: {:.4f}, loss_spa: {:.4f}, label: {}, bag_size: {}'.format(batch_idx, loss_value, loss_bag_value, loss_spa_value, int(label.item()), data.size(0)))
+            print('batch {}, loss: {:.4f}, loss_bag: {:.4f}, loss_spa: {:.4f}, label: {}, bag_size: {}'.format(batch_idx, loss_value, loss_bag_value, loss_spa_value, label.tolist(), list(data.shape[:-1])))
         loss.backward()
         optimizer.step()
         optimizer.zero_grad()
@@ -291,6 +305,11 @@ def validate(epoch, model, loader, n_classes, writer, loss_fn):
 
 # ******** Updated ********
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train AttriMIL on every split of the cohort')
+    parser.add_argument('--batch_size', type=int, default=1, help='bags per training step, padded and masked when > 1')
+    parser.add_argument('--cache_mb', type=int, default=0, help='shared in-memory bag cache budget (MB), 0 disables it')
+    args = parser.parse_args()
+
     csv_path = '/content/AttriMIL-LungCancer/datasets/tcga_nsclc_labels.csv'
     data_dir = '/content/AttriMIL_Workspace/data'  
     split_path = '/content/AttriMIL-LungCancer/splits/'
@@ -306,7 +325,8 @@ if __name__ == "__main__":
                                   print_info = True,
                                   label_dict = {0:0, 1:1}, 
                                   patient_strat=False,
-                                  ignore=[])
+                                  ignore=[],
+                                  cache_bytes=args.cache_mb << 20)
     
     csv_paths = [split_path + 'splits_0.csv']
     
@@ -319,4 +339,5 @@ if __name__ == "__main__":
                      fold = step,
                      writer_flag = True,
                      max_epoch = 50,     
-                     early_stopping = False,)
\ No newline at end of file
+                     early_stopping = False,
+                     batch_size = args.batch_size,)
\ No newline at end of file
@@ -1,6 +1,7 @@
 from dataloader import Generic_WSI_Classification_Dataset, Generic_MIL_Dataset
 
 import os
+import argparse
 import torch
 from torch import nn
 import torch.optim as optim
@@ -113,6 +114,7 @@ def train_dsmil(datasets,
                 writer_flag = True,
                 max_epoch = 200,
                 early_stopping = True,
+                batch_size = 1,
                 ):
     writer_dir = os.path.join(save_path, str(fold))
     if not os.path.isdir(writer_dir):
@@ -140,7 +142,7 @@ def train_dsmil(datasets,
     optimizer = optim.SGD(filter(lambda p: p.requires_grad, model.parameters()), lr=2e-4, momentum=0.9, weight_decay=1e-5)
     
     print('\nInit Loaders...', end=' ')
-    train_loader = get_split_loader(train_split, training=True, testing = False, weighted = True)
+    train_loader = get_split_loader(train_split, training=True, testing = False, weighted = True, batch_size = batch_size)
     val_loader = get_split_loader(val_split,  testing = False)
     test_loader = get_split_loader(test_split, testing = False)
     print('Done!')
@@ -176,15 +178,25 @@ def train_loop(epoch, model, loader, optimizer, n_classes, writer, loss_fn):
     ins_loss = 0.
     
     print('\n')
-    for batch_idx, (data, label, coords, nearest) in enumerate(loader):
+    for batch_idx, (data, label, coords, nearest, *mask) in enumerate(loader):
         data, label = data.to(device), label.to(device)
         
-        ins_prediction, bag_prediction, _, _ = model(data)
-        Y_hat = torch.topk(bag_prediction.view(1, -1), 1, dim = 1)[1]
-        acc_logger.log(Y_hat, label)
-        max_prediction, _ = torch.max(ins_prediction, 0)
-        loss_bag = loss_fn(bag_prediction.view(1, -1), label)
-        loss_ins = loss_fn(max_prediction.view(1, -1), label)
+        if mask:
+            # padded bag batch (batch_size > 1)
+            mask = mask[0].to(device)
+            ins_prediction, bag_prediction, _, _ = model(data, mask)
+            Y_hat = torch.topk(bag_prediction, 1, dim = 1)[1]
+            acc_logger.log_batch(Y_hat.view(-1).cpu().numpy(), label.cpu().numpy())
+            max_prediction, _ = torch.max(ins_prediction.masked_fill(~mask.unsqueeze(-1), float('-inf')), 1)
+            loss_bag = loss_fn(bag_prediction, label)
+            loss_ins = loss_fn(max_prediction, label)
+        else:
+            ins_prediction, bag_prediction, _, _ = model(data)
+            Y_hat = torch.topk(bag_prediction.view(1, -1), 1, dim = 1)[1]
+            acc_logger.log(Y_hat, label)
+            max_prediction, _ = torch.max(ins_prediction, 0)
+            loss_bag = loss_fn(bag_prediction.view(1, -1), label)
+            loss_ins = loss_fn(max_prediction.view(1, -1), label)
         loss = 0.5 * loss_bag + 0.5 * loss_ins
         
         loss_bag_value = loss_bag.item()
@@ -196,7 +208,7 @@ def train_loop(epoch, model, loader, optimizer, n_classes, writer, loss_fn):
         ins_loss += loss_ins
         
         if (batch_idx + 1) % 20 == 0:
-            print('batch {}, loss: {:.4f}, loss_bag: {:.4f}, loss_ins: {:.4f}, bag_size: {}'.format(batch_idx, loss_value, loss_bag_value, loss_ins_value, label.item(), data.size(0)))
+            print('batch {}, loss: {:.4f}, loss_bag: {:.4f}, loss_ins: {:.4f}, bag_size: {}'.format(batch_idx, loss_value, loss_bag_value, loss_ins_value, list(data.shape[:-1])))
             
         loss.backward()
         optimizer.step()
@@ -264,6 +276,11 @@ def validate(epoch, model, loader, n_classes, writer, loss_fn):
     return val_loss
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train DSMIL on every split of the cohort')
+    parser.add_argument('--batch_size', type=int, default=1, help='bags per training step, padded and masked when > 1')
+    parser.add_argument('--cache_mb', type=int, default=0, help='shared in-memory bag cache budget (MB), 0 disables it')
+    args = parser.parse_args()
+
     csv_path = '/data1/ceiling/workspace/AttriMIL_v2/dataset_csv/camelyon16_total.csv'
     data_dir = '/data2/clh/camelyon16/resnet18_imagenet/'
     split_path = '/data1/ceiling/workspace/AttriMIL_v2/splits/camelyon16_100/'
@@ -277,7 +294,8 @@ if __name__ == "__main__":
                             print_info = True,
                             label_dict = {'normal_tissue':0, 'tumor_tissue':1},
                             patient_strat=False,
-                            ignore=[])
+                            ignore=[],
+                            cache_bytes=args.cache_mb << 20)
     csv_path = [split_path + 'splits_{}.csv'.format(i) for i in range(5)]
     for step, name in enumerate(csv_path):
         train_dataset, val_dataset, test_dataset = dataset.return_splits(from_id=False, csv_path=name)
@@ -288,4 +306,5 @@ if __name__ == "__main__":
                      fold = step,
                      writer_flag = True,
                      max_epoch = 200,
-                     early_stopping = False,)
\ No newline at end of file
+                     early_stopping = False,
+                     batch_size = args.batch_size,)
\ No newline at end of file
@@ -1,6 +1,7 @@
 from dataloader import Generic_WSI_Classification_Dataset, Generic_MIL_Dataset
 
 import os
+import argparse
 import torch
 from torch import nn
 import torch.optim as optim
@@ -247,6 +248,10 @@ def validate(epoch, model, loader, n_classes, writer, loss_fn):
     return val_loss
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the MIL pooling baselines on every split of the cohort')
+    parser.add_argument('--cache_mb', type=int, default=0, help='shared in-memory bag cache budget (MB), 0 disables it')
+    args = parser.parse_args()
+
     csv_path = '/data1/ceiling/workspace/AttriMIL_v2/dataset_csv/unitopatho_train.csv'
     data_dir = '/data2/clh/unitopatho/resnet18_imagenet/'
     split_path = '/data1/ceiling/workspace/AttriMIL_v2/splits/unitopatho/'
@@ -259,7 +264,8 @@ if __name__ == "__main__":
                             print_info = True,
                             label_dict = {'NORM':0, 'HP':1, 'TA.HG':2,'TA.LG':3, 'TVA.HG':4, 'TVA.LG':5},
                             patient_strat=False,
-                            ignore=[])
+                            ignore=[],
+                            cache_bytes=args.cache_mb << 20)
     csv_path = [split_path + 'splits_{}.csv'.format(i) for i in range(5)]
     for step, name in enumerate(csv_path):
         train_dataset, val_dataset, test_dataset = dataset.return_splits(from_id=False, csv_path=name)
@@ -12,6 +12,7 @@ from torch.utils.data import DataLoader, Sampler, WeightedRandomSampler, RandomS
 import torch.optim as optim
 import pdb
 import torch.nn.functional as F
+from torch.nn.utils.rnn import pad_sequence
 import math
 from itertools import islice
 import collections
@@ -44,23 +45,79 @@ def collate_MIL_coords(batch):  # 训练时候，我需要有coords函数
 	nearest = torch.cat([torch.from_numpy(item[3]) for item in batch], dim=0)
 	return [img, label, coords, nearest]
 
+def collate_MIL_padded(batch):
+	# several bags per step: zero-pad to the longest bag and return a B x N mask of the real instances
+	sizes = torch.LongTensor([item[0].size(0) for item in batch])
+	img = pad_sequence([item[0] for item in batch], batch_first=True)
+	label = torch.LongTensor([item[1] for item in batch])
+	coords = pad_sequence([torch.from_numpy(item[2]) for item in batch], batch_first=True)
+	nearest = pad_sequence([torch.from_numpy(item[3]) for item in batch], batch_first=True)
+	mask = torch.arange(img.size(1)).unsqueeze(0) < sizes.unsqueeze(1)
+	return [img, label, coords, nearest, mask]
+
 def collate_features(batch):
 	img = torch.cat([item[0] for item in batch], dim = 0)
 	coords = np.vstack([item[1] for item in batch])
 	return [img, coords]
 
 
+class BucketBatchSampler(Sampler):
+	"""Yields batches of bags with similar sizes to bound the padding of collate_MIL_padded.
+
+	Arguments:
+		sizes (sequence): number of instances of every bag
+		batch_size (int): bags per batch
+		weights (sequence): optional sampling weights, drawn with replacement like WeightedRandomSampler
+		shuffle (bool): shuffle the bags (and the order of the batches) every epoch
+		bucket_batches (int): batches per bucket; bags are sorted by size inside a bucket only
+	"""
+	def __init__(self, sizes, batch_size, weights=None, shuffle=True, bucket_batches=50):
+		self.sizes = np.asarray(sizes)
+		self.batch_size = batch_size
+		self.weights = weights
+		self.shuffle = shuffle
+		self.bucket_batches = bucket_batches
+
+	def __iter__(self):
+		n = len(self.sizes)
+		if self.weights is not None:
+			indices = torch.multinomial(torch.as_tensor(self.weights, dtype=torch.double), n, replacement=True).numpy()
+		elif self.shuffle:
+			indices = np.random.permutation(n)
+		else:
+			indices = np.arange(n)
+		bucket = self.batch_size * self.bucket_batches
+		batches = []
+		for start in range(0, n, bucket):
+			chunk = indices[start: start + bucket]
+			chunk = chunk[np.argsort(self.sizes[chunk], kind='stable')]
+			batches.extend(chunk[i: i + self.batch_size].tolist() for i in range(0, len(chunk), self.batch_size))
+		if self.shuffle or self.weights is not None:
+			batches = [batches[i] for i in np.random.permutation(len(batches))]
+		return iter(batches)
+
+	def __len__(self):
+		return (len(self.sizes) + self.batch_size - 1) // self.batch_size
+
 def get_simple_loader(dataset, batch_size=1, num_workers=1):
 	kwargs = {'num_workers': 4, 'pin_memory': False, 'num_workers': num_workers} if device.type == "cuda" else {}
 	loader = DataLoader(dataset, batch_size=batch_size, sampler = sampler.SequentialSampler(dataset), collate_fn = collate_MIL, **kwargs)
 	return loader 
 
-def get_split_loader(split_dataset, training = False, testing = False, weighted = False):
+def get_split_loader(split_dataset, training = False, testing = False, weighted = False, batch_size = 1, num_workers = None):
 	"""
 		return either the validation loader or training loader 
+		batch_size > 1 yields size-bucketed, zero-padded bag batches with a mask (see collate_MIL_padded)
+		num_workers overrides the default of 4 loader workers on cuda and none on cpu
 	"""
 	kwargs = {'num_workers': 4} if device.type == "cuda" else {}
-	if not testing:
+	if num_workers is not None:
+		kwargs['num_workers'] = num_workers
+	if batch_size > 1 and not testing:
+		weights = make_weights_for_balanced_classes_split(split_dataset) if training and weighted else None
+		batch_sampler = BucketBatchSampler(split_dataset.get_bag_sizes(), batch_size, weights=weights, shuffle=training)
+		loader = DataLoader(split_dataset, batch_sampler=batch_sampler, collate_fn = collate_MIL_padded, **kwargs)
+	elif not testing:
 		if training:
 			if weighted:
 				weights = make_weights_for_balanced_classes_split(split_dataset)